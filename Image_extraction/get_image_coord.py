@@ -1,93 +1,121 @@
-from pydantic import BaseModel, Field
-from typing import List, Literal
-from Text_extraction.google_llm import get_file_coordinates
-
-from langchain.output_parsers import PydanticOutputParser
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import AzureChatOpenAI
+from models import StampCoordinate, StampDetectionResult
+from typing import List
+from constants import STAMP_REFERENCE_PATH, STAMP_THUMBNAIL_EDGE
+from Text_extraction.render_cache import render_page, read_cached_render, get_file_hash
+from Image_extraction.stamp_detector import detect_stamps
 
 from PIL import Image
+from collections import defaultdict
+import threading
+import asyncio
+import hashlib
 import base64
 import fitz
 import io
 import os
 
 
-llm = AzureChatOpenAI(
-    deployment_name="gpt-4o",
-    model="gpt-4o",
-    temperature=0.0,
-    api_version="2025-01-01-preview"
-)
+def save_stamp_crops(crops: List[Image.Image], file_names: List[str], save_dir: str = "stamps") -> List[str]:
+    os.makedirs(save_dir, exist_ok=True)
+    saved_paths = []
+    for cropped, file_name in zip(crops, file_names):
+        out_path = os.path.join(save_dir, file_name)
+        cropped.save(out_path)
+        saved_paths.append(out_path)
+    return saved_paths
 
 
-class StampCoordinate(BaseModel):
-    page_number: int = Field(..., description="Page number where stamp is found (1-indexed)")
-    x: int = Field(..., description="Top-left x-coordinate of stamp in pixels")
-    y: int = Field(..., description="Top-left y-coordinate of stamp in pixels")
-    width: int = Field(..., description="Width of the stamp region in pixels")
-    height: int = Field(..., description="Height of the stamp region in pixels")
-    confidence: float = Field(..., description="Confidence score of detection, between 0 and 1")
+def crop_image_stamps(image_path: str, coords: List[StampCoordinate]) -> List[Image.Image]:
+    with Image.open(image_path) as original:
+        return [
+            original.crop((coord.x, coord.y, coord.x + coord.width, coord.y + coord.height))
+            for coord in coords
+        ]
 
-class StampDetectionResult(BaseModel):
-    document_type: Literal["pdf", "image"]
-    filename: str
-    stamp_coordinates: List[StampCoordinate]
 
+def crop_pdf_stamps(pdf_path: str, coords: List[StampCoordinate], dpi: int = 150) -> List[Image.Image | None]:
+    """
+    Crops stamps out of a PDF in memory. Coordinates are grouped by page and every page is
+    decoded once: from the render cache when it has the page, else rasterized and cut straight
+    from the pixmap, skipping the PNG encoding (about twice the rasterization time for scans).
+    :param coords: Stamp coordinates in pixels of the page rendered at `dpi`.
+    :return: One image per coordinate, in the order of `coords`; None for pages the PDF does not have.
+    """
+    coords_by_page = defaultdict(list)
+    for i, coord in enumerate(coords):
+        coords_by_page[coord.page_number - 1].append((i, coord))
+
+    crops = [None] * len(coords)
+    file_hash = get_file_hash(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        for page_index, page_coords in coords_by_page.items():
+            if not 0 <= page_index < len(doc):
+                continue
+            cached = read_cached_render(file_hash, page_index, dpi, "png")
+            if cached is not None:
+                page_image = Image.open(io.BytesIO(cached))
+            else:
+                pix = doc[page_index].get_pixmap(dpi=dpi)
+                # Shares the pixmap's memory, crop copies out only the stamp
+                page_image = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
+            for i, coord in page_coords:
+                crops[i] = page_image.crop((coord.x, coord.y, coord.x + coord.width, coord.y + coord.height))
+    return crops
+
+
+def crop_stamps(file_path: str, coords: List[StampCoordinate]) -> List[Image.Image | None]:
+    if file_path.lower().endswith(".pdf"):
+        return crop_pdf_stamps(file_path, coords)
+    return crop_image_stamps(file_path, coords)
+
+
+def stamp_thumbnail(cropped: Image.Image, max_edge: int = STAMP_THUMBNAIL_EDGE) -> str:
+    """
+    :return: data URL of a JPEG thumbnail of the crop, at most `max_edge` pixels on its longest edge.
+    """
+    thumbnail = cropped.convert("RGB")
+    thumbnail.thumbnail((max_edge, max_edge))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=85)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+def store_stamp_crop(cropped: Image.Image, save_dir: str) -> tuple[str, str]:
+    """
+    Stores the crop as PNG under its SHA-256, the same stamp cropped twice is stored once.
+    :return: Tuple of the SHA-256 and the path relative to `save_dir`.
+    """
+    buffer = io.BytesIO()
+    cropped.save(buffer, format="PNG")
+    image_bytes = buffer.getvalue()
+    digest = hashlib.sha256(image_bytes).hexdigest()
+
+    relative_path = os.path.join(digest[:2], f"{digest}.png")
+    out_path = os.path.join(save_dir, relative_path)
+    if not os.path.exists(out_path):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        temp_path = f"{out_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(image_bytes)
+        os.replace(temp_path, out_path)
+    return digest, relative_path
 
 
 def extract_stamps_from_image(image_path: str, coords: List[StampCoordinate], save_dir: str = "stamps") -> List[str]:
-    os.makedirs(save_dir, exist_ok=True)
-    original = Image.open(image_path)
     file_name = os.path.basename(image_path)
-    saved_paths = []
-
-    for i, coord in enumerate(coords, 1):
-        left = coord.x
-        top = coord.y
-        right = coord.x + coord.width
-        bottom = coord.y + coord.height
-
-        cropped = original.crop((left, top, right, bottom))
-        out_path = os.path.join(save_dir, f"{file_name}_stamp_{i}.png")
-        cropped.save(out_path)
-        saved_paths.append(out_path)
-
-    return saved_paths
+    crops = crop_image_stamps(image_path, coords)
+    return save_stamp_crops(crops, [f"{file_name}_stamp_{i}.png" for i in range(1, len(crops) + 1)], save_dir)
 
 
 def extract_stamps_from_pdf(pdf_path: str, coords: List[StampCoordinate], save_dir="stamps") -> List[str]:
-    os.makedirs(save_dir, exist_ok=True)
     file_name = os.path.basename(pdf_path)
-    saved_paths = []
-
-    # Open the PDF using fitz (PyMuPDF)
-    doc = fitz.open(pdf_path)
-    
-    for i, coord in enumerate(coords):
-        page_index = coord.page_number - 1
-        if page_index >= len(doc):
-            continue
-
-        page = doc[page_index]
-        pix = page.get_pixmap(dpi=150)
-        img_bytes = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_bytes))
-
-        # Crop the stamp
-        cropped = img.crop((
-            coord.x,
-            coord.y,
-            coord.x + coord.width,
-            coord.y + coord.height
-        ))
-
-        out_path = os.path.join(save_dir, f"{file_name}_stamp_page{coord.page_number}_{i+1}.png")
-        cropped.save(out_path)
-        saved_paths.append(out_path)
-
-    doc.close()
-    return saved_paths
+    crops = crop_pdf_stamps(pdf_path, coords)
+    found = [(i, cropped) for i, cropped in enumerate(crops) if cropped is not None]
+    return save_stamp_crops(
+        [cropped for _, cropped in found],
+        [f"{file_name}_stamp_page{coords[i].page_number}_{i+1}.png" for i, _ in found],
+        save_dir
+    )
 
 
 def load_file_as_base64(path: str) -> dict:
@@ -97,10 +125,10 @@ def load_file_as_base64(path: str) -> dict:
 
     if mimetype == "application/pdf":
         doc = fitz.open(path)
+        file_hash = get_file_hash(path)
         images = []
         for page in doc:
-            pix = page.get_pixmap(dpi=150)
-            buffer = io.BytesIO(pix.tobytes("png"))
+            buffer = io.BytesIO(render_page(path, page.number, 150, "png", file_hash, doc))
             base64_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
             images.append(base64_str)
         doc.close()
@@ -131,7 +159,26 @@ def load_file_as_base64(path: str) -> dict:
     return message_content
 
 
-async def run_stamp_detection(file_path: str, stamp_reference_path: str = "ProjectData//AllMasterStamps-1.pdf"):
+def llm_stamp_coordinates(file_path: str, stamp_reference_path: str) -> StampDetectionResult:
+    # Imported on demand, the Gemini and Groq clients are not needed for local detection
+    from Text_extraction.google_llm import get_file_coordinates
+
+    return get_file_coordinates(file_path, stamp_reference_path)
+
+
+async def get_stamp_coordinates(file_path: str, stamp_reference_path: str = STAMP_REFERENCE_PATH,
+                                use_llm: bool = False) -> StampDetectionResult:
+    # Both paths block (file uploads and LLM calls, or OpenCV), they run in worker threads
+    if use_llm:
+        return await asyncio.to_thread(llm_stamp_coordinates, file_path, stamp_reference_path)
+    return await asyncio.to_thread(detect_stamps, file_path)
+
+
+async def run_stamp_detection(file_path: str, stamp_reference_path: str = STAMP_REFERENCE_PATH,
+                              use_llm: bool = False, save_dir: str | None = "stamps"):
+    """
+    :param save_dir: Directory the stamp crops are written to, None returns the cropped images instead of paths.
+    """
     filename = os.path.basename(file_path)
     # messages = load_file_as_base64(file_path)
     # stamp_reference_image = load_file_as_base64(stamp_reference_path)
@@ -148,22 +195,25 @@ async def run_stamp_detection(file_path: str, stamp_reference_path: str = "Proje
     # }
     # response = llm_structured.invoke([message])
 
-    coordinates = await get_file_coordinates(file_path)
+    coordinates = await get_stamp_coordinates(file_path, stamp_reference_path, use_llm)
 
     print(coordinates)
 
+    if save_dir is None:
+        crops = await asyncio.to_thread(crop_stamps, file_path, coordinates.stamp_coordinates)
+        return [cropped for cropped in crops if cropped is not None]
+
     stamp_save_paths = []
     if filename.endswith(".pdf"):
-        stamp_save_paths = extract_stamps_from_pdf(file_path, coordinates.stamp_coordinates)
+        stamp_save_paths = await asyncio.to_thread(extract_stamps_from_pdf, file_path, coordinates.stamp_coordinates, save_dir)
     else:
-        stamp_save_paths = extract_stamps_from_image(file_path, coordinates.stamp_coordinates)
+        stamp_save_paths = await asyncio.to_thread(extract_stamps_from_image, file_path, coordinates.stamp_coordinates, save_dir)
 
     return stamp_save_paths
 
 
-# result = await run_stamp_detection(r"C:\Users\hp\Downloads\USE CASE Number-6(Doc to Data)\DOCUMENT INFORMATION TEMPLATES\Reward Letter\Reward Letter sample_2.jpg")
-# print(result)
+if __name__ == "__main__":
+    # Crops the stamps of a file into ./stamps: python -m Image_extraction.get_image_coord <file> [--llm]
+    import sys
 
-import asyncio
-result = asyncio.run(run_stamp_detection(r"C:\Users\hp\Downloads\USE CASE Number-6(Doc to Data)\DOCUMENT INFORMATION TEMPLATES\Reward Letter\Reward Letter sample_2.jpg"))
-print(result)
\ No newline at end of file
+    print(asyncio.run(run_stamp_detection(sys.argv[1], use_llm="--llm" in sys.argv)))
@@ -0,0 +1,95 @@
+from models import StampCoordinate, StampDetectionResult
+from constants import STAMP_DETECTION_DPI, STAMP_INK_HSV_RANGE, STAMP_MIN_WIDTH, STAMP_MIN_HEIGHT
+from constants import STAMP_MAX_ASPECT_RATIO, STAMP_MIN_INK_DENSITY
+from Text_extraction.render_cache import render_pages, get_file_hash
+
+import numpy as np
+import cv2
+import fitz
+import os
+
+
+def load_pages(file_path: str, dpi: int = STAMP_DETECTION_DPI) -> list[np.ndarray]:
+    """
+    Returns the pages of a PDF rendered at `dpi`, or the image itself, as BGR arrays.
+    """
+    if not file_path.lower().endswith(".pdf"):
+        # np.fromfile + imdecode also reads paths cv2.imread cannot (non-ASCII on Windows)
+        return [cv2.imdecode(np.fromfile(file_path, np.uint8), cv2.IMREAD_COLOR)]
+
+    with fitz.open(file_path) as doc:
+        page_count = len(doc)
+    renders = render_pages(file_path, list(range(page_count)), dpi, "png", get_file_hash(file_path))
+    return [cv2.imdecode(np.frombuffer(render, np.uint8), cv2.IMREAD_COLOR) for render in renders]
+
+
+def find_stamp_regions(page: np.ndarray) -> list[tuple[int, int, int, int, float]]:
+    """
+    Finds blue/violet ink stamps on a BGR page image: ink pixels are segmented by colour,
+    closed into solid blobs and split into connected components. Components too small,
+    too elongated or too sparse to be a stamp are dropped.
+    :return: List of (x, y, width, height, confidence) in pixels of the page.
+    """
+    page_width = page.shape[1]
+    hsv = cv2.cvtColor(page, cv2.COLOR_BGR2HSV)
+    ink = cv2.inRange(hsv, *STAMP_INK_HSV_RANGE)
+
+    # Kernel of ~1.3% of the page width joins the strokes and letters of one stamp
+    kernel_size = max(3, round(page_width * 0.013))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    blobs = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(blobs, connectivity=8)
+    regions = []
+    for x, y, width, height, area in stats[1:count]:
+        if width < page_width * STAMP_MIN_WIDTH or height < page_width * STAMP_MIN_HEIGHT:
+            continue
+        if width / height > STAMP_MAX_ASPECT_RATIO:
+            continue
+        ink_density = cv2.countNonZero(ink[y:y + height, x:x + width]) / (width * height)
+        if ink_density < STAMP_MIN_INK_DENSITY:
+            continue
+        # Dense, solid blobs look most like stamps
+        fill = area / (width * height)
+        confidence = min(1.0, ink_density / 0.15) * min(1.0, fill / 0.4)
+        regions.append((int(x), int(y), int(width), int(height), round(confidence, 2)))
+    return regions
+
+
+def detect_stamps(file_path: str, dpi: int = STAMP_DETECTION_DPI) -> StampDetectionResult:
+    """
+    Local replacement of the LLM stamp coordinates (get_file_coordinates). Coordinates of
+    PDF pages are in pixels of the page rendered at `dpi`, as extract_stamps_from_pdf expects.
+    """
+    stamp_coordinates = [
+        StampCoordinate(page_number=page_number, x=x, y=y, width=width, height=height, confidence=confidence)
+        for page_number, page in enumerate(load_pages(file_path, dpi), start=1)
+        for x, y, width, height, confidence in find_stamp_regions(page)
+    ]
+    return StampDetectionResult(
+        document_type="pdf" if file_path.lower().endswith(".pdf") else "image",
+        filename=os.path.basename(file_path),
+        stamp_coordinates=stamp_coordinates
+    )
+
+
+if __name__ == "__main__":
+    # Detection time over the sample letters: python -m Image_extraction.stamp_detector [samples directory]
+    import glob
+    import sys
+    import time
+
+    samples_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join("USE CASE Number-6(Doc to Data)", "DOCUMENT INFORMATION TEMPLATES")
+    sample_paths = sorted(glob.glob(os.path.join(samples_dir, "*", "*sample_*")))
+
+    total_ms, total_pages = 0.0, 0
+    for sample_path in sample_paths:
+        pages = load_pages(sample_path)
+        start = time.perf_counter()
+        regions = [find_stamp_regions(page) for page in pages]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        total_ms += elapsed_ms
+        total_pages += len(pages)
+        print(f"{os.path.basename(sample_path)}: {sum(map(len, regions))} stamps on {len(pages)} pages in {elapsed_ms:.1f} ms")
+
+    print(f"{len(sample_paths)} files, {total_pages} pages: {total_ms / max(total_pages, 1):.1f} ms per page (rendering excluded)")
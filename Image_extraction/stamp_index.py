@@ -0,0 +1,197 @@
+from constants import STAMP_REFERENCE_PATH, STAMP_LIST_DIR, STAMP_INDEX_PATH, STAMP_MATCH_MIN_VOTES, STAMP_MATCH_MIN_SHARE
+from Image_extraction.stamp_detector import load_pages, find_stamp_regions
+
+import threading
+import numpy as np
+import cv2
+import fitz
+import os
+import re
+
+
+INDEX_IMAGE_WIDTH = 400  # masters and crops are compared at this width
+ORB_FEATURES = 300
+ORB_MAX_DISTANCE = 64  # Hamming distance of 256 bit descriptors, farther matches do not vote
+RATIO_TEST = 0.8
+PHASH_MAX_DISTANCE = 6  # of 64 bits, closer crops are the master image itself
+
+
+def normalise(image: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = INDEX_IMAGE_WIDTH / gray.shape[1]
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def perceptual_hash(gray: np.ndarray) -> np.ndarray:
+    """
+    64 bit pHash: low frequencies of the DCT of a 32x32 thumbnail, thresholded at their median.
+    """
+    dct = cv2.dct(np.float32(cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)))[:8, :8]
+    return np.packbits(dct > np.median(dct))
+
+
+def orb_descriptors(gray: np.ndarray) -> np.ndarray | None:
+    _, descriptors = cv2.ORB_create(ORB_FEATURES).detectAndCompute(gray, None)
+    return descriptors
+
+
+def read_stamp_names(list_dir: str = STAMP_LIST_DIR) -> dict[int, str]:
+    """
+    Parses "Stamp Names.txt" of the master stamp list, lines like "1.jpg – Head Officer, Mangalagiri Stamp".
+    :return: Dictionary of stamp number to stamp name.
+    """
+    names = {}
+    with open(os.path.join(list_dir, "Stamp Names.txt"), encoding="utf-8") as f:
+        for line in f:
+            match = re.match(r"\s*(\d+)\.jpg\s*\W\s*(.+?)(?:\s+Stamp)?\s*$", line)
+            if match:
+                names[int(match.group(1))] = match.group(2)
+    return names
+
+
+def master_stamp_images(reference_path: str = STAMP_REFERENCE_PATH, list_dir: str = STAMP_LIST_DIR) -> list[tuple[int, np.ndarray]]:
+    """
+    Every master image of every stamp: the images embedded in the reference PDF, numbered
+    from top to bottom, and the {number}.jpg files of the master stamp list.
+    :return: List of (stamp number, BGR image).
+    """
+    masters = []
+    with fitz.open(reference_path) as doc:
+        for page in doc:
+            infos = sorted(page.get_image_info(xrefs=True), key=lambda info: info["bbox"][1])
+            for number, info in enumerate(infos, start=1):
+                image_bytes = doc.extract_image(info["xref"])["image"]
+                masters.append((number, cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)))
+
+    for number in read_stamp_names(list_dir):
+        image_path = os.path.join(list_dir, f"{number}.jpg")
+        if os.path.exists(image_path):
+            masters.append((number, cv2.imdecode(np.fromfile(image_path, np.uint8), cv2.IMREAD_COLOR)))
+    return masters
+
+
+def build_stamp_index(index_path: str = STAMP_INDEX_PATH, reference_path: str = STAMP_REFERENCE_PATH,
+                      list_dir: str = STAMP_LIST_DIR) -> None:
+    """
+    Computes the pHash and ORB descriptors of the master stamps and saves them to `index_path`.
+    Run again whenever the master stamps change: python -m Image_extraction.stamp_index
+    """
+    names = read_stamp_names(list_dir)
+    phashes, phash_labels, descriptors, labels = [], [], [], []
+    for number, image in master_stamp_images(reference_path, list_dir):
+        gray = normalise(image)
+        phashes.append(perceptual_hash(gray))
+        phash_labels.append(number)
+        image_descriptors = orb_descriptors(gray)
+        if image_descriptors is not None:
+            descriptors.append(image_descriptors)
+            labels += [number] * len(image_descriptors)
+
+    numbers = sorted(names)
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    np.savez_compressed(
+        index_path,
+        numbers=np.array(numbers),
+        names=np.array([names[number] for number in numbers]),
+        phashes=np.array(phashes),
+        phash_labels=np.array(phash_labels),
+        descriptors=np.vstack(descriptors),
+        labels=np.array(labels)
+    )
+
+
+class StampIndex:
+    """
+    Master stamps loaded from the index file. A crop is matched by its ORB descriptors: each
+    descriptor votes for the stamp of its nearest master descriptor when the match is close
+    and unambiguous, and the stamp with most votes wins. A crop whose pHash is within
+    PHASH_MAX_DISTANCE of a master is a copy of that master and skips the ORB matching.
+    """
+
+    def __init__(self, index_path: str = STAMP_INDEX_PATH):
+        with np.load(index_path) as index:
+            self.names = dict(zip(index["numbers"].tolist(), index["names"].tolist()))
+            self.phashes = index["phashes"]
+            self.phash_labels = index["phash_labels"]
+            self.descriptors = index["descriptors"]
+            self.labels = index["labels"]
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def match(self, crop: np.ndarray) -> tuple[str, float] | None:
+        """
+        :param crop: BGR or grayscale image of one stamp.
+        :return: Tuple of the stamp name and the share of votes it got, None when no stamp matches.
+        """
+        gray = normalise(crop)
+        distances = np.unpackbits(self.phashes ^ perceptual_hash(gray), axis=1).sum(axis=1)
+        if distances.min() <= PHASH_MAX_DISTANCE:
+            return self.names[int(self.phash_labels[distances.argmin()])], 1.0
+
+        descriptors = orb_descriptors(gray)
+        if descriptors is None or len(descriptors) < 2:
+            return None
+
+        votes = np.zeros(max(self.names) + 1, int)
+        for nearest in self.matcher.knnMatch(descriptors, self.descriptors, k=2):
+            if len(nearest) < 2:
+                continue
+            first, second = nearest
+            if first.distance >= ORB_MAX_DISTANCE:
+                continue
+            # Both neighbours from the same stamp is as good as a clear winner
+            if self.labels[first.trainIdx] == self.labels[second.trainIdx] or first.distance < RATIO_TEST * second.distance:
+                votes[self.labels[first.trainIdx]] += 1
+
+        best = int(votes.argmax())
+        share = votes[best] / votes.sum() if votes.sum() else 0.0
+        if votes[best] < STAMP_MATCH_MIN_VOTES or share < STAMP_MATCH_MIN_SHARE:
+            return None
+        return self.names[best], round(float(share), 2)
+
+
+_stamp_index: StampIndex | None = None
+_stamp_index_lock = threading.Lock()
+
+
+def get_stamp_index() -> StampIndex:
+    global _stamp_index
+
+    with _stamp_index_lock:
+        if _stamp_index is None:
+            _stamp_index = StampIndex(STAMP_INDEX_PATH)
+        return _stamp_index
+
+
+def identify_stamps(file_path: str) -> list[dict]:
+    """
+    Finds the stamps of a document (see stamp_detector) and names them with the stamp index.
+    :return: List of {"page_number", "name", "confidence"}, in reading order.
+    """
+    index = get_stamp_index()
+    stamps = []
+    for page_number, page in enumerate(load_pages(file_path), start=1):
+        for x, y, width, height, _ in sorted(find_stamp_regions(page), key=lambda region: (region[1], region[0])):
+            match = index.match(page[y:y + height, x:x + width])
+            if match:
+                stamps.append({"page_number": page_number, "name": match[0], "confidence": match[1]})
+    return stamps
+
+
+if __name__ == "__main__":
+    # Builds the index, then matches the stamps of the sample letters: python -m Image_extraction.stamp_index
+    import glob
+    import time
+
+    start = time.perf_counter()
+    build_stamp_index()
+    print(f"Built {STAMP_INDEX_PATH} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    samples_dir = os.path.join("USE CASE Number-6(Doc to Data)", "DOCUMENT INFORMATION TEMPLATES")
+    for sample_path in sorted(glob.glob(os.path.join(samples_dir, "*", "*sample_*"))):
+        for page_number, page in enumerate(load_pages(sample_path), start=1):
+            for x, y, width, height, _ in find_stamp_regions(page):
+                start = time.perf_counter()
+                match = get_stamp_index().match(page[y:y + height, x:x + width])
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                print(f"{os.path.basename(os.path.dirname(sample_path))}/{os.path.basename(sample_path)} "
+                      f"page {page_number}: {match} in {elapsed_ms:.1f} ms")
@@ -0,0 +1,210 @@
+from MongoDB.database import insert_job, update_job, get_job, get_unfinished_jobs, insert_user_file
+from constants import JOB_WORKERS, FILE_CONCURRENCY, COMBINED_MIN_CONFIDENCE
+from Validations.validate_forms import validation_functions
+from Text_extraction.extract_data import document_classification, extract_json, classify_and_extract
+from metrics import stage_span, collect_spans
+
+from datetime import datetime
+from uuid import uuid4
+
+import asyncio
+
+
+job_queue: asyncio.Queue | None = None
+
+
+def create_job(user_id: str, files: list[dict], concurrency: int | None = None, combined: bool = False) -> dict:
+    """
+    Creates a queued upload job.
+    :param user_id: ID of the user who uploaded the files.
+    :param files: List of saved files, each with filename, file_path, content_type and file_hash.
+    :param concurrency: Maximum number of files of this job processed in parallel (defaults to FILE_CONCURRENCY).
+    :param combined: Classify and extract each file in a single LLM call.
+    :return: The job document as stored in MongoDB.
+    """
+    job_data = {
+        "job_id": uuid4().hex,
+        "user_id": user_id,
+        "status": "queued",
+        "concurrency": concurrency,
+        "combined": combined,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        "files": [
+            {**file, "status": "queued", "error": None, "result": None, "issues": [], "timings": []}
+            for file in files
+        ],
+        "extracted_data": None,
+        "issues_in_documents": [],
+    }
+    result = insert_job(job_data)
+    if result["status"] != "success":
+        raise RuntimeError(result["message"])
+    return job_data
+
+
+async def classify_and_extract_file(file_entry: dict) -> tuple[str | None, dict | None]:
+    """
+    Single call mode. Returns (None, None) when the combined call fails or is not
+    confident enough, so the caller can fall back to the two step path.
+    """
+    try:
+        with stage_span("combined") as span:
+            result = await classify_and_extract(file_entry["file_path"], file_hash=file_entry.get("file_hash"))
+            span["document_type"] = result.get("document_type")
+    except Exception as e:
+        print(f"Combined extraction failed for {file_entry['filename']}, falling back: {e}")
+        return None, None
+
+    if not result.get("document_type") or result.get("confidence", 0) < COMBINED_MIN_CONFIDENCE:
+        return None, None
+    return result["document_type"], result["extracted_text"]
+
+
+async def process_file(file_entry: dict, combined: bool = False) -> tuple[dict, list]:
+    """
+    Classifies, extracts and validates a single uploaded file.
+    :param combined: Classify and extract in one LLM call, falling back to two calls if needed.
+    :return: Tuple of the file data stored for the user and the validation issues.
+    """
+    file_location = file_entry["file_path"]
+    issues_in_document = []
+
+    document_type, extracted_text = None, None
+    if combined:
+        document_type, extracted_text = await classify_and_extract_file(file_entry)
+
+    if not document_type:
+        with stage_span("classification") as span:
+            document_classification_result = await document_classification(file_location, file_entry.get("file_hash"))
+            document_type = span["document_type"] = document_classification_result.get("document_type")
+    print(document_type)
+
+    if not document_type:
+        extracted_text = document_classification_result.get("extracted_text", "")
+    else:
+        if extracted_text is None:
+            with stage_span("extraction", document_type):
+                extracted_text = await extract_json(
+                                    file_location,
+                                    document_type,
+                                    file_hash=file_entry.get("file_hash")
+                                )
+        print(extracted_text)
+        with stage_span("validation", document_type):
+            valid = validation_functions[document_type](extracted_text)
+
+        extracted_text["document_status"] = valid["document_status"]
+        issues_in_document = valid["issues"]
+        print(issues_in_document)
+
+    file_data = {
+        "file_id": uuid4().hex,
+        "upload_date": datetime.now().strftime("%d %m %Y %H:%M:%S"),
+        "filename": file_entry["filename"],
+        "file_path": file_location,
+        "document_type": document_type,
+        "extracted_text": extracted_text if extracted_text else {},
+        "content_type": file_entry["content_type"],
+        "file_hash": file_entry.get("file_hash")
+    }
+    return file_data, issues_in_document
+
+
+async def process_job(job_id: str) -> None:
+    """
+    Runs every file of a job through the pipeline, recording progress per file.
+    Files already completed before a restart are not processed again.
+    """
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        print(f"Job {job_id} not found.")
+        return
+
+    await asyncio.to_thread(update_job, job_id, {"status": "processing"})
+
+    semaphore = asyncio.Semaphore(max(1, job.get("concurrency") or FILE_CONCURRENCY))
+
+    async def run_file(index: int, file_entry: dict) -> tuple[dict, list] | None:
+        if file_entry["status"] == "completed":
+            return file_entry["result"], file_entry["issues"]
+
+        async with semaphore:
+            with collect_spans() as spans:
+                await asyncio.to_thread(update_job, job_id, {f"files.{index}.status": "processing"})
+                try:
+                    file_data, issues = await process_file(file_entry, job.get("combined", False))
+                except Exception as e:
+                    print(f"Error processing file {file_entry['filename']}: {e}")
+                    await asyncio.to_thread(update_job, job_id, {
+                        f"files.{index}.status": "error",
+                        f"files.{index}.error": str(e),
+                        f"files.{index}.timings": spans
+                    })
+                    return None
+
+                with stage_span("mongodb", file_data["document_type"]):
+                    await asyncio.to_thread(update_job, job_id, {
+                        f"files.{index}.status": "completed",
+                        f"files.{index}.result": file_data,
+                        f"files.{index}.issues": issues,
+                        f"files.{index}.timings": spans
+                    })
+                return file_data, issues
+
+    # gather keeps the results in input order regardless of completion order
+    results = await asyncio.gather(*(run_file(index, file_entry) for index, file_entry in enumerate(job["files"])))
+
+    user_data = {
+        "user_id": job["user_id"],
+        "files": []
+    }
+    issues_in_documents = []
+    for result in results:
+        if result is None:
+            continue
+        file_data, issues = result
+        user_data["files"].append(file_data)
+        issues_in_documents = issues
+
+    with stage_span("mongodb"):
+        result = await asyncio.to_thread(insert_user_file, user_data)
+    if result["status"] != "success":
+        await asyncio.to_thread(update_job, job_id, {"status": "failed", "error": result["message"]})
+        return
+
+    await asyncio.to_thread(update_job, job_id, {
+        "status": "completed",
+        "extracted_data": user_data,
+        "issues_in_documents": issues_in_documents
+    })
+
+
+async def job_worker() -> None:
+    while True:
+        job_id = await job_queue.get()
+        try:
+            await process_job(job_id)
+        except Exception as e:
+            print(f"Error processing job {job_id}: {e}")
+            await asyncio.to_thread(update_job, job_id, {"status": "failed", "error": str(e)})
+        finally:
+            job_queue.task_done()
+
+
+async def enqueue_job(job_id: str) -> None:
+    await job_queue.put(job_id)
+
+
+def start_job_workers(workers: int = JOB_WORKERS) -> list[asyncio.Task]:
+    """
+    Creates the job queue, re-queues jobs left unfinished by a previous run and starts the workers.
+    Must be called from within the running event loop (application startup).
+    """
+    global job_queue
+    job_queue = asyncio.Queue()
+
+    for job in get_unfinished_jobs():
+        job_queue.put_nowait(job["job_id"])
+
+    return [asyncio.create_task(job_worker()) for _ in range(workers)]
@@ -1,8 +1,9 @@
 from models import UserModel, InsertUserFileModel, FileFiltersModel
-from constants import MONGODB_URI, DATABASE_NAME, USER_COLLECTION_NAME, DATA_COLLECTION_NAME
+from constants import MONGODB_URI, DATABASE_NAME, USER_COLLECTION_NAME, DATA_COLLECTION_NAME, JOB_COLLECTION_NAME, EXTRACTION_CACHE_COLLECTION_NAME
 from pymongo import MongoClient
 from bson.binary import Binary
 from uuid import uuid4
+from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -231,4 +232,161 @@ def get_all_users_files() -> list[dict]:
             return updated_docs
     except Exception as e:
         print(f"Error retrieving user files: {e}")
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+
+def insert_job(job_data: dict) -> dict:
+    """
+    Inserts a new upload job into the MongoDB collection.
+    :param job_data: Dictionary containing the job id, owner, file list and status.
+    :return: Dictionary containing the status of the operation and job ID if successful.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            job_collection = db[JOB_COLLECTION_NAME]
+            job_collection.insert_one({**job_data})
+    except Exception as e:
+        print(f"Error inserting job: {e}")
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "success", "job_id": job_data["job_id"]}
+
+
+def update_job(job_id: str, update_data: dict) -> dict:
+    """
+    Updates fields of an upload job.
+    :param job_id: ID of the job to be updated.
+    :param update_data: Dictionary of fields to set. Dotted keys (e.g. "files.0.status") are allowed.
+    :return: Dictionary containing the status of the operation.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            job_collection = db[JOB_COLLECTION_NAME]
+
+            result = job_collection.update_one(
+                {"job_id": job_id},
+                {"$set": {**update_data, "updated_at": datetime.utcnow()}}
+            )
+
+            if result.matched_count > 0:
+                return {"status": "success", "message": "Job updated successfully"}
+            else:
+                return {"status": "error", "message": "No matching job found"}
+    except Exception as e:
+        print(f"Error updating job: {e}")
+        return {"status": "error", "message": str(e)}
+
+
+def get_job(job_id: str) -> dict | None:
+    """
+    Retrieves an upload job.
+    :param job_id: ID of the job.
+    :return: Job document without the MongoDB "_id" or None if not found.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            job_collection = db[JOB_COLLECTION_NAME]
+            return job_collection.find_one({"job_id": job_id.strip()}, {"_id": 0})
+    except Exception as e:
+        print(f"Error retrieving job: {e}")
+        return None
+
+
+def get_unfinished_jobs() -> list[dict]:
+    """
+    Retrieves the jobs that were queued or in progress, e.g. when the server was restarted.
+    :return: List of job documents ordered by creation.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            job_collection = db[JOB_COLLECTION_NAME]
+            query = {"status": {"$in": ["queued", "processing"]}}
+            return list(job_collection.find(query, {"_id": 0}).sort("created_at", 1))
+    except Exception as e:
+        print(f"Error retrieving unfinished jobs: {e}")
+        return []
+
+
+def create_extraction_cache_indexes(ttl_seconds: int = 0) -> dict:
+    """
+    Creates the indexes of the extraction cache: a unique index on cache_key for the lookups,
+    and with ttl_seconds a TTL index on created_at so that MongoDB deletes older entries.
+    :param ttl_seconds: Age in seconds entries expire at, 0 keeps them until the cache is cleared.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            cache_collection = db[EXTRACTION_CACHE_COLLECTION_NAME]
+            cache_collection.create_index("cache_key", unique=True)
+
+            ttl_index = cache_collection.index_information().get("created_at_1")
+            if ttl_seconds and ttl_index is None:
+                cache_collection.create_index("created_at", expireAfterSeconds=ttl_seconds)
+            elif ttl_seconds and ttl_index.get("expireAfterSeconds") != ttl_seconds:
+                # An existing TTL index keeps its options on create_index, collMod changes them
+                db.command("collMod", EXTRACTION_CACHE_COLLECTION_NAME,
+                           index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": ttl_seconds})
+            elif not ttl_seconds and ttl_index is not None:
+                cache_collection.drop_index("created_at_1")
+    except Exception as e:
+        print(f"Error creating extraction cache indexes: {e}")
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "success"}
+
+
+def get_cached_extraction(cache_key: str) -> dict | None:
+    """
+    Retrieves a cached LLM result.
+    :param cache_key: Key built from the file hash, document type, model, prompt and schema versions.
+    :return: The cached result or None if not found.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            cache_collection = db[EXTRACTION_CACHE_COLLECTION_NAME]
+            entry = cache_collection.find_one({"cache_key": cache_key}, {"_id": 0, "result": 1})
+            return entry["result"] if entry else None
+    except Exception as e:
+        print(f"Error retrieving cached extraction: {e}")
+        return None
+
+
+def upsert_cached_extraction(cache_key: str, result: dict) -> dict:
+    """
+    Stores an LLM result in the cache, replacing any previous entry for the key.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            cache_collection = db[EXTRACTION_CACHE_COLLECTION_NAME]
+            cache_collection.update_one(
+                {"cache_key": cache_key},
+                {"$set": {"result": result, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+    except Exception as e:
+        print(f"Error caching extraction: {e}")
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "success"}
+
+
+def clear_extraction_cache() -> dict:
+    """
+    Removes every cached LLM result.
+    """
+    try:
+        with MongoClient(MONGODB_URI) as client:
+            db = client[DATABASE_NAME]
+            cache_collection = db[EXTRACTION_CACHE_COLLECTION_NAME]
+            result = cache_collection.delete_many({})
+    except Exception as e:
+        print(f"Error clearing extraction cache: {e}")
+        return {"status": "error", "message": str(e)}
+
+    return {"status": "success", "deleted": result.deleted_count}
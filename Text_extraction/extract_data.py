@@ -1,53 +1,70 @@
-from models import document_models, DocumentClassificationResult
-from prompts import extract_json_prompt, document_classification_prompt, DOCUMENT_DESCRIPTION
-
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import AzureChatOpenAI
+from models import document_models, DocumentClassificationResult, ClassifiedDocument
+from prompts import extract_json_prompt, document_classification_prompt, classify_and_extract_prompt, DOCUMENT_DESCRIPTION
+from prompts import DOCUMENT_IMAGE_SETTINGS, DEFAULT_IMAGE_SETTINGS, STAMP_FIELDS, local_stamp_matching_note
+from prompts import DOCUMENT_LAYOUT_PROFILES
+from constants import STAMP_REFERENCE_PATH, CLASSIFICATION_PASSES, CLASSIFICATION_MIN_CONFIDENCE
+from constants import TEXT_LAYER_FAST_PATH, TEXT_LAYER_MIN_CHARS, LOCAL_STAMP_MATCHING, ROI_EXTRACTION
+from Text_extraction.result_cache import file_sha256, extraction_cache_key, get_cached_result, set_cached_result, schema_version
+from Text_extraction.render_cache import render_pages, get_file_hash
+from Text_extraction.providers import llm_router
+from Text_extraction.rate_limit import estimate_image_tokens, content_image_tokens
+from Image_extraction.stamp_index import identify_stamps
+from metrics import stage_span
 
 from pydantic import BaseModel, Field
+from typing import get_origin
+from collections import defaultdict
+from PIL import Image
+import asyncio
 import base64
+import hashlib
+import threading
+import time
 import fitz
 import os
 import io
 
 
-from langfuse import Langfuse
-from langfuse.langchain import CallbackHandler
-
-langfuse = Langfuse(
-  secret_key="sk-lf-d54c76d6-6c46-425c-b1ea-211256dcea06",
-  public_key="pk-lf-7065a313-db9f-4bc3-b6ad-0e1e68cd0a61",
-  host="http://20.102.104.3:3000"
-)
-
-langfuse_handler = CallbackHandler()
-
-# llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0)
-llm = AzureChatOpenAI(
-    deployment_name="gpt-4o",
-    model="gpt-4o",
-    temperature=0.0,
-    api_version="2025-01-01-preview"
-)
-
-
-
-def load_file_as_base64(path: str) -> dict:
-    
+def load_file_as_base64(path: str, dpi: int | None = None, max_pages: int | None = None, max_edge: int | None = None,
+                        image_settings: dict | None = None) -> list:
+    """
+    Builds the message content blocks for a PDF or image.
+    Born-digital PDF pages are sent as positioned text instead of an image (see get_page_text_layer).
+    :param dpi: Resolution PDF pages are rendered at (image_settings["dpi"] or 150 when None).
+    :param max_pages: Only the first `max_pages` pages of a PDF are sent (all when None).
+    :param max_edge: Downscale images so that their longest edge is at most this many pixels.
+    :param image_settings: Preprocessing applied to every image, see DOCUMENT_IMAGE_SETTINGS.
+    """
+    dpi = dpi or (image_settings or {}).get("dpi", 150)
     mimetype = "application/pdf" if path.endswith(".pdf") else "image/jpg"
     message_content = []
 
     if mimetype == "application/pdf":
+        file_hash = get_file_hash(path)
         doc = fitz.open(path)
-        images = []
-        for page in doc:
-            pix = page.get_pixmap(dpi=150)
-            buffer = io.BytesIO(pix.tobytes("png"))
-            base64_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            images.append(base64_str)
+        total_pages = len(doc)
+        page_indexes = list(range(min(max_pages or total_pages, total_pages)))
+        text_layers = {
+            page_index: get_page_text_layer(doc[page_index]) if TEXT_LAYER_FAST_PATH else None
+            for page_index in page_indexes
+        }
         doc.close()
-        total_pages = len(images)
-        for i, img in enumerate(images, start=1):
+
+        image_pages = [page_index for page_index in page_indexes if not text_layers[page_index]]
+        renders = dict(zip(image_pages, render_pages(path, image_pages, dpi, "png", file_hash)))
+
+        for page_index in page_indexes:
+            i = page_index + 1
+            if text_layers[page_index]:
+                message_content.append({
+                    "type": "text",
+                    "text": f"Page {i} of {total_pages} (text layer, lines prefixed with [x0, y0, x1, y1] in points)\n{text_layers[page_index]}"
+                })
+                continue
+
+            image_bytes, image_mimetype = optimise_image(renders[page_index], "PNG", max_edge, image_settings)
+            img = base64.b64encode(image_bytes).decode("utf-8")
+
             message_content.append({
                 "type": "text",
                 "text": f"Page {i} of {total_pages}"
@@ -57,60 +74,496 @@ def load_file_as_base64(path: str) -> dict:
             message_content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/png;base64,{img}"
+                    "url": f"data:{image_mimetype};base64,{img}"
                 }
             })
     else:
         with open(path, "rb") as f:
-            encoded = base64.b64encode(f.read()).decode("utf-8")
+            image_bytes, image_mimetype = optimise_image(f.read(), "JPEG", max_edge, image_settings)
+            encoded = base64.b64encode(image_bytes).decode("utf-8")
 
             message_content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpg;base64,{encoded}"
+                    "url": f"data:{image_mimetype};base64,{encoded}"
                 }
             })
     return message_content
 
 
+def get_page_text_layer(page: fitz.Page) -> str | None:
+    """
+    Returns the page text with block positions when the page has a usable text layer,
+    i.e. enough text and no embedded images. Pages with images are scans, or carry
+    stamps and signatures the model has to see, so they are sent as images.
+    """
+    if page.get_images():
+        return None
+
+    blocks = [block for block in page.get_text("blocks", sort=True) if block[6] == 0 and block[4].strip()]
+    if sum(len(block[4].strip()) for block in blocks) < TEXT_LAYER_MIN_CHARS:
+        return None
+
+    return "\n".join(
+        f"[{x0:.0f}, {y0:.0f}, {x1:.0f}, {y1:.0f}] {' '.join(text.split())}"
+        for x0, y0, x1, y1, text, *_ in blocks
+    )
+
+
+IMAGE_MIMETYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def optimise_image(image_bytes: bytes, source_format: str, max_edge: int | None = None,
+                   image_settings: dict | None = None) -> tuple[bytes, str]:
+    """
+    Downscales, converts and re-encodes an image before it is sent to the LLM.
+    The image is returned untouched when no setting requires a change.
+    :param source_format: PIL format of `image_bytes` ("PNG" or "JPEG").
+    :param max_edge: Longest edge in pixels, the smaller of this and image_settings["max_edge"] wins.
+    :param image_settings: Dictionary with optional "grayscale", "format", "quality" and "max_edge" keys.
+    :return: Tuple of the image bytes and their mimetype.
+    """
+    settings = image_settings or {}
+    image_format = settings.get("format", source_format)
+    max_edge = min([edge for edge in (max_edge, settings.get("max_edge")) if edge], default=None)
+
+    image = Image.open(io.BytesIO(image_bytes))
+    resize = max_edge is not None and max(image.size) > max_edge
+    if not resize and not settings.get("grayscale") and image_format == source_format and "quality" not in settings:
+        return image_bytes, IMAGE_MIMETYPES[source_format]
+
+    return encode_image(image, image_format, max_edge, settings)
+
+
+def encode_image(image: Image.Image, image_format: str, max_edge: int | None = None,
+                 image_settings: dict | None = None) -> tuple[bytes, str]:
+    """
+    Downscales to `max_edge`, applies the grayscale and quality settings and encodes the image.
+    :return: Tuple of the image bytes and their mimetype.
+    """
+    settings = image_settings or {}
+    if max_edge is not None and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge))
+    if settings.get("grayscale"):
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format=image_format, optimize=True)
+    else:
+        image.save(buffer, format=image_format, quality=settings.get("quality", 85))
+    return buffer.getvalue(), IMAGE_MIMETYPES[image_format]
+
+
+def region_fields(schema: type[BaseModel], region: dict) -> list[str]:
+    if region["fields"] is not None:
+        return region["fields"]
+    # Every field read from the document, i.e. not document_status and the validation flags
+    return [
+        name for name, field in schema.model_fields.items()
+        if get_origin(field.annotation) is list or (isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel))
+    ]
+
+
+def load_document_regions(path: str, schema: type[BaseModel], profile: list[dict],
+                          image_settings: dict | None = None) -> list | None:
+    """
+    Builds the message content blocks of the regions of interest of a document: each
+    region of the layout profile is cropped from its page and tagged with the fields
+    expected in it. Every page is decoded once, whatever its number of regions.
+    :return: Content blocks, None when full pages are the better choice: the document has
+             text layer pages or pages the profile does not know, or the crops would cost
+             at least as many image tokens as the pages.
+    """
+    settings = image_settings or DEFAULT_IMAGE_SETTINGS
+    dpi = settings.get("dpi", 150)
+    image_format = settings.get("format", "JPEG")
+    page_numbers = sorted({region["page"] for region in profile})
+
+    if path.endswith(".pdf"):
+        with fitz.open(path) as doc:
+            if len(doc) != page_numbers[-1]:
+                return None
+            if TEXT_LAYER_FAST_PATH and any(get_page_text_layer(doc[number - 1]) for number in page_numbers):
+                return None
+        renders = render_pages(path, [number - 1 for number in page_numbers], dpi, "png", get_file_hash(path))
+        pages = {number: Image.open(io.BytesIO(render)) for number, render in zip(page_numbers, renders)}
+    elif page_numbers == [1]:
+        pages = {1: Image.open(path)}
+    else:
+        return None
+
+    full_tokens = sum(estimate_image_tokens(*page.size) for page in pages.values())
+    message_content = []
+    region_tokens = 0
+    for region in profile:
+        page = pages[region["page"]]
+        left, top, right, bottom = region["box"]
+        cropped = page.crop((round(left * page.width), round(top * page.height), round(right * page.width), round(bottom * page.height)))
+        image_bytes, image_mimetype = encode_image(cropped, image_format, settings.get("max_edge"), settings)
+        region_tokens += estimate_image_tokens(*cropped.size)
+
+        fields = [schema.model_fields[field].alias or field for field in region_fields(schema, region)]
+        message_content.append({
+            "type": "text",
+            "text": f"Region of page {region['page']} of {len(pages)}, expected fields: {', '.join(fields)}"
+        })
+        message_content.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{image_mimetype};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+            }
+        })
+
+    if region_tokens >= full_tokens:
+        return None
+    print(f"Sending {len(profile)} regions of {os.path.basename(path)}: ~{region_tokens} image tokens instead of ~{full_tokens}")
+    return message_content
+
+
+def is_empty_value(value) -> bool:
+    if value is None or value == "":
+        return True
+    if isinstance(value, list):
+        return all(is_empty_value(item) for item in value)
+    if isinstance(value, dict):
+        if "extracted_text" in value:
+            return is_empty_value(value["extracted_text"])
+        return all(is_empty_value(item) for item in value.values())
+    return False
+
+
+def empty_region_fields(schema: type[BaseModel], profile: list[dict], result: dict) -> list[str]:
+    """
+    Fields of the regions that came back without any value, most likely cropped wrongly.
+    """
+    fields = []
+    for region in profile:
+        names = region_fields(schema, region)
+        if all(is_empty_value(result.get(name)) for name in names):
+            fields += names
+    return fields
+
+
+def full_render_image_tokens(path: str, dpi: int = 150) -> int:
+    """
+    Image tokens the file would cost when every page is sent at `dpi`, computed
+    from the page sizes without rendering.
+    """
+    if not path.endswith(".pdf"):
+        with Image.open(path) as image:
+            return estimate_image_tokens(*image.size)
+
+    with fitz.open(path) as doc:
+        return sum(
+            estimate_image_tokens(page.rect.width * dpi / 72, page.rect.height * dpi / 72)
+            for page in doc
+        )
+
+
+# document type -> counters of the cheap classification pass
+classification_stats = defaultdict(lambda: {
+    "documents": 0,
+    "escalated": 0,
+    "image_tokens_sent": 0,
+    "image_tokens_full": 0,
+    "cheap_pass_ms": 0.0,
+    "cheap_pass_count": 0,
+    "full_pass_ms": 0.0,
+    "full_pass_count": 0
+})
+
 
-async def document_classification(doc_path: str) -> dict:
-    structured_llm = llm.with_structured_output(DocumentClassificationResult)
-            
-    file_content = load_file_as_base64(doc_path)
-    message = {
-        "role": "user",
-        "content": [
-            {"type": "text", "text": document_classification_prompt},
-        ] + file_content,
-    }
-    response = structured_llm.invoke([message], config={"callbacks": [langfuse_handler]})
+def get_classification_stats() -> dict:
+    """
+    Per document type savings of the cheap classification pass. Milliseconds saved are
+    estimated from the measured average of full passes (run on escalation) minus the
+    average of cheap passes, for the documents that did not escalate.
+    """
+    report = {}
+    for document_type, stats in classification_stats.items():
+        cheap_ms = stats["cheap_pass_ms"] / stats["cheap_pass_count"] if stats["cheap_pass_count"] else None
+        full_ms = stats["full_pass_ms"] / stats["full_pass_count"] if stats["full_pass_count"] else None
+        not_escalated = stats["documents"] - stats["escalated"]
+        report[document_type] = {
+            "documents": stats["documents"],
+            "escalated": stats["escalated"],
+            "image_tokens_saved": stats["image_tokens_full"] - stats["image_tokens_sent"],
+            "avg_cheap_pass_ms": cheap_ms,
+            "avg_full_pass_ms": full_ms,
+            "ms_saved": (full_ms - cheap_ms) * not_escalated if cheap_ms is not None and full_ms is not None else None
+        }
+    return report
+
+
+# path -> {"mtime": ..., "size": ..., "sha256": ..., "content": [...]}
+_stamp_reference_cache = {}
+_stamp_reference_lock = threading.Lock()
+
+
+def get_stamp_reference_content(path: str = STAMP_REFERENCE_PATH) -> list:
+    """
+    Returns the message content blocks of the stamp reference file.
+    The blocks are built once and reused; they are rebuilt only when the file's
+    mtime/size changes and its SHA-256 differs from the cached one.
+    """
+    stat = os.stat(path)
+    with _stamp_reference_lock:
+        cached = _stamp_reference_cache.get(path)
+        if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+            return cached["content"]
+
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        if cached and cached["sha256"] == digest:
+            cached["mtime"], cached["size"] = stat.st_mtime_ns, stat.st_size
+            return cached["content"]
+
+        content = load_file_as_base64(path)
+        _stamp_reference_cache[path] = {
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "content": content
+        }
+        return content
+
+
+def warm_up_structured_models() -> None:
+    """
+    Resolves the output schemas and the structured output runnables of every provider
+    at startup, so that the first request does not pay for them.
+    """
+    schemas = list(document_models.values()) + [DocumentClassificationResult, ClassifiedDocument]
+    for schema in schemas:
+        schema_version(schema)
+    llm_router.warm_up(schemas)
+
+
+def build_messages(prompt: str, static_content: list, document_content: list) -> list:
+    """
+    Lays a request out for provider-side prompt caching, which reuses the longest
+    identical prefix of earlier requests: the prompt as system message, then the content
+    shared across documents, and the document itself last.
+    """
+    return [
+        {"role": "system", "content": prompt},
+        {
+            "role": "user",
+            "content": static_content + [{"type": "text", "text": "Document to analyse:"}] + document_content
+        }
+    ]
+
+
+def stamp_reference_blocks(stamp_reference_content: list) -> list:
+    if LOCAL_STAMP_MATCHING:
+        return [{"type": "text", "text": local_stamp_matching_note}]
+    return [{"type": "text", "text": "Stamp reference (known stamp names):"}] + stamp_reference_content
+
+
+def layout_prompts(profile: list[dict] | None) -> list[str]:
+    # Results read from regions are cached apart from those read from full pages
+    return [repr(profile)] if profile else []
+
+
+def content_settings_prompts(image_settings: dict) -> list[str]:
+    # Results are cached per image preprocessing and text layer setting, tuning either sends different content
+    return [repr(image_settings), repr((TEXT_LAYER_FAST_PATH, TEXT_LAYER_MIN_CHARS))]
+
+
+def stamp_matching_prompts() -> list[str]:
+    # Results with locally matched stamps are cached apart from those matched by the LLM
+    return [local_stamp_matching_note] if LOCAL_STAMP_MATCHING else []
+
+
+async def load_stamp_reference(stamp_reference_path: str) -> list:
+    # Stamps matched locally need no reference images in the request
+    if LOCAL_STAMP_MATCHING:
+        return []
+    return await asyncio.to_thread(get_stamp_reference_content, stamp_reference_path)
+
+
+def fill_stamp_fields(document_type: str, fields: dict, stamps: list[dict]) -> dict:
+    """
+    Fills the stamp fields of extracted data with the stamps identified by the stamp index.
+    In the order of STAMP_FIELDS, each field gets the most confident stamp on its page with
+    the expected name that no earlier field took, so one stamp fills at most one field.
+    Fields without a matching stamp are left as they are.
+    :param stamps: Output of identify_stamps.
+    """
+    unused = sorted(stamps, key=lambda stamp: stamp["confidence"], reverse=True)
+    for field, (page_number, stamp_name) in STAMP_FIELDS.get(document_type, {}).items():
+        stamp = next((
+            stamp for stamp in unused
+            if page_number in (None, stamp["page_number"]) and stamp_name in (None, stamp["name"])
+        ), None)
+        if stamp is not None:
+            unused.remove(stamp)
+            fields[field] = {"extracted_text": stamp["name"], "confidence": stamp["confidence"], "text_type": "machine_printed"}
+    return fields
+
+
+async def document_classification(doc_path: str, file_hash: str | None = None) -> dict:
+    file_hash = file_hash or await asyncio.to_thread(file_sha256, doc_path)
+    cache_key = extraction_cache_key(
+        "document_classification", file_hash, None, llm_router.model_name,
+        [document_classification_prompt, repr(CLASSIFICATION_PASSES), repr(CLASSIFICATION_MIN_CONFIDENCE)]
+        + content_settings_prompts(DEFAULT_IMAGE_SETTINGS), DocumentClassificationResult
+    )
+    cached = await asyncio.to_thread(get_cached_result, cache_key)
+    if cached is not None:
+        return cached
+
+    # Cheapest pass first, escalate while the model is not confident enough
+    response = None
+    image_tokens_sent = 0
+    for pass_index, (max_pages, dpi, max_edge) in enumerate(CLASSIFICATION_PASSES):
+        start = time.perf_counter()
+        with stage_span("render"):
+            file_content = await asyncio.to_thread(load_file_as_base64, doc_path, dpi, max_pages, max_edge, DEFAULT_IMAGE_SETTINGS)
+        messages = build_messages(document_classification_prompt, [], file_content)
+        response = await llm_router.ainvoke_structured(DocumentClassificationResult, messages)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        image_tokens_sent += await asyncio.to_thread(content_image_tokens, file_content)
+
+        if not isinstance(response, BaseModel):
+            break
+
+        stats = classification_stats[response.document_type]
+        is_last_pass = pass_index == len(CLASSIFICATION_PASSES) - 1
+        if is_last_pass and pass_index > 0:
+            stats["full_pass_ms"] += elapsed_ms
+            stats["full_pass_count"] += 1
+        elif pass_index == 0:
+            stats["cheap_pass_ms"] += elapsed_ms
+            stats["cheap_pass_count"] += 1
+
+        if response.confidence >= CLASSIFICATION_MIN_CONFIDENCE or is_last_pass:
+            stats["documents"] += 1
+            stats["escalated"] += 1 if pass_index > 0 else 0
+            stats["image_tokens_sent"] += image_tokens_sent
+            stats["image_tokens_full"] += await asyncio.to_thread(full_render_image_tokens, doc_path)
+            print(f"Classified {response.document_type} in pass {pass_index + 1} ({elapsed_ms:.0f} ms, "
+                  f"confidence {response.confidence})")
+            break
+
+    if isinstance(response, BaseModel):
+        result = response.model_dump()
+        await asyncio.to_thread(set_cached_result, cache_key, result)
+        return result
+    else:
+        return {"status": "error", "message": "Invalid response format"}
+
+
+async def load_extraction_content(doc_path: str, schema: type[BaseModel], image_settings: dict,
+                                  profile: list[dict] | None) -> tuple[list, bool]:
+    """
+    :return: Tuple of the content blocks and whether they are the regions of `profile`.
+    """
+    if profile:
+        region_content = await asyncio.to_thread(load_document_regions, doc_path, schema, profile, image_settings)
+        if region_content is not None:
+            return region_content, True
+    return await asyncio.to_thread(load_file_as_base64, doc_path, image_settings=image_settings), False
+
+
+async def extract_json(doc_path: str, document_type: str = "ProbationLetter", stamp_reference_path: str = STAMP_REFERENCE_PATH,
+                       file_hash: str | None = None) -> dict:
+    schema = document_models[document_type]
+    image_settings = DOCUMENT_IMAGE_SETTINGS.get(document_type, DEFAULT_IMAGE_SETTINGS)
+    profile = DOCUMENT_LAYOUT_PROFILES.get(document_type) if ROI_EXTRACTION else None
+    file_hash = file_hash or await asyncio.to_thread(file_sha256, doc_path)
+    cache_key = extraction_cache_key(
+        "extract_json", file_hash, document_type, llm_router.model_name,
+        [extract_json_prompt, DOCUMENT_DESCRIPTION[document_type]] + content_settings_prompts(image_settings)
+        + stamp_matching_prompts() + layout_prompts(profile), schema
+    )
+    cached = await asyncio.to_thread(get_cached_result, cache_key)
+    if cached is not None:
+        return cached
+
+    # Rendering is CPU bound, keep it off the event loop
+    with stage_span("render", document_type):
+        (document_image, regions_sent), stamp_reference_image = await asyncio.gather(
+            load_extraction_content(doc_path, schema, image_settings, profile),
+            load_stamp_reference(stamp_reference_path)
+        )
+
+    # Shared by every document of this type: stamp reference first, then the type description
+    static_content = stamp_reference_blocks(stamp_reference_image) + [
+        {"type": "text", "text": DOCUMENT_DESCRIPTION[document_type]}
+    ]
+    messages = build_messages(extract_json_prompt, static_content, document_image)
+
+    response = await llm_router.ainvoke_structured(schema, messages)
 
     if isinstance(response, BaseModel):
-        return response.model_dump()
+        result = response.model_dump()
+        empty_fields = empty_region_fields(schema, profile, result) if regions_sent else []
+        if empty_fields:
+            print(f"Re-reading {len(empty_fields)} empty region fields of {document_type} from full pages")
+            with stage_span("render", document_type):
+                full_pages = await asyncio.to_thread(load_file_as_base64, doc_path, image_settings=image_settings)
+            full_response = await llm_router.ainvoke_structured(schema, build_messages(extract_json_prompt, static_content, full_pages))
+            if isinstance(full_response, BaseModel):
+                full_result = full_response.model_dump()
+                for field in empty_fields:
+                    result[field] = full_result[field]
+        if LOCAL_STAMP_MATCHING:
+            with stage_span("stamp_matching", document_type):
+                stamps = await asyncio.to_thread(identify_stamps, doc_path)
+            fill_stamp_fields(document_type, result, stamps)
+        await asyncio.to_thread(set_cached_result, cache_key, result)
+        return result
     else:
         return {"status": "error", "message": "Invalid response format"}
 
 
-async def extract_json(doc_path: str, document_type: str = "ProbationLetter", stamp_reference_path: str = "ProjectData//AllMasterStamps-1.pdf") -> dict:
-    
-    document_image = load_file_as_base64(doc_path)
-    stamp_reference_image = load_file_as_base64(stamp_reference_path)
-    
-    structured_llm = llm.with_structured_output(document_models.get(document_type))
-    
-    message = {
-        "role": "user",
-        "content": [
-            {"type": "text", "text": extract_json_prompt},
-            {"type": "text", "text": DOCUMENT_DESCRIPTION[document_type]}
-        ]  + document_image + stamp_reference_image,
-    }
-    
-    response = structured_llm.invoke([message], config={"callbacks": [langfuse_handler]})
+async def classify_and_extract(doc_path: str, stamp_reference_path: str = STAMP_REFERENCE_PATH,
+                               file_hash: str | None = None) -> dict:
+    """
+    Classifies the document and extracts its fields in a single LLM call, sending the
+    page images once instead of once per step.
+    :return: Dictionary with document_type, confidence and the extracted fields as extracted_text.
+    """
+    document_descriptions = "\n".join(f"{name}: {description}" for name, description in DOCUMENT_DESCRIPTION.items())
+    file_hash = file_hash or await asyncio.to_thread(file_sha256, doc_path)
+    cache_key = extraction_cache_key(
+        "classify_and_extract", file_hash, None, llm_router.model_name,
+        [classify_and_extract_prompt, document_descriptions] + content_settings_prompts(DEFAULT_IMAGE_SETTINGS)
+        + stamp_matching_prompts(), ClassifiedDocument
+    )
+    cached = await asyncio.to_thread(get_cached_result, cache_key)
+    if cached is not None:
+        return cached
+
+    with stage_span("render"):
+        document_image, stamp_reference_image = await asyncio.gather(
+            asyncio.to_thread(load_file_as_base64, doc_path, image_settings=DEFAULT_IMAGE_SETTINGS),
+            load_stamp_reference(stamp_reference_path)
+        )
+
+    static_content = stamp_reference_blocks(stamp_reference_image) + [
+        {"type": "text", "text": document_descriptions}
+    ]
+    messages = build_messages(classify_and_extract_prompt, static_content, document_image)
+
+    response = await llm_router.ainvoke_structured(ClassifiedDocument, messages)
 
     if isinstance(response, BaseModel):
-        return response.model_dump()
+        result = {
+            "document_type": response.document.document_type,
+            "confidence": response.document.confidence,
+            "extracted_text": response.document.fields.model_dump()
+        }
+        if LOCAL_STAMP_MATCHING:
+            with stage_span("stamp_matching", result["document_type"]):
+                stamps = await asyncio.to_thread(identify_stamps, doc_path)
+            fill_stamp_fields(result["document_type"], result["extracted_text"], stamps)
+        await asyncio.to_thread(set_cached_result, cache_key, result)
+        return result
     else:
         return {"status": "error", "message": "Invalid response format"}
-    
\ No newline at end of file
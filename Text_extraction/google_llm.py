@@ -1,42 +1,97 @@
 from prompts import TEXT_EXTRACTION_PROMPT, document_classification_prompt, extract_json_prompt
-from models import PunishmentLetter, document_models, DocumentClassificationResult
-
-from pydantic import BaseModel, Field
-from typing import Literal, List
+from models import PunishmentLetter, document_models, DocumentClassificationResult, StampDetectionResult
+from constants import GEMINI_FILE_EXPIRY_MARGIN_SECONDS
+from Text_extraction.render_cache import get_file_hash
+from Text_extraction.http_clients import http_client_args, get_http_client, get_async_http_client
+
+from pydantic import BaseModel
+from concurrent.futures import Future
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
 from langchain_groq import ChatGroq
 from google import genai
+from google.genai import types
+import threading
 import os
 
 
-class StampCoordinate(BaseModel):
-    page_number: int = Field(..., description="Page number where stamp is found (1-indexed)")
-    x: int = Field(..., description="Top-left x-coordinate of stamp in pixels")
-    y: int = Field(..., description="Top-left y-coordinate of stamp in pixels")
-    width: int = Field(..., description="Width of the stamp region in pixels")
-    height: int = Field(..., description="Height of the stamp region in pixels")
-    confidence: float = Field(..., description="Confidence score of detection, between 0 and 1")
+# Clients are built on first use, importing this module needs no credentials
+@lru_cache(maxsize=None)
+def get_client() -> genai.Client:
+    # genai builds its own httpx clients, configured with the shared pool settings
+    return genai.Client(
+        api_key=os.environ.get("GOOGLE_API_KEY", ""),
+        http_options=types.HttpOptions(client_args=http_client_args(), async_client_args=http_client_args())
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm() -> ChatGroq:
+    return ChatGroq(
+        model="llama-3.3-70b-versatile",
+        max_retries=3,
+        temperature=0.1,
+        http_client=get_http_client("groq"),
+        http_async_client=get_async_http_client("groq")
+    )
+
+
+@lru_cache(maxsize=None)
+def get_structured_llm(schema: type[BaseModel]):
+    return get_llm().with_structured_output(schema)
+
+
+# sha256 of the content -> uploaded file handle
+_uploaded_files: dict[str, types.File] = {}
+# sha256 of the content -> upload in progress, concurrent callers wait for it instead of uploading again
+_pending_uploads: dict[str, Future] = {}
+_uploads_lock = threading.Lock()
+
+
+def upload_file(path: str) -> types.File:
+    """
+    Uploads a file to the Gemini Files API once per content hash and returns the handle.
+    Handles are reused until GEMINI_FILE_EXPIRY_MARGIN_SECONDS before the provider expires them.
+    """
+    file_hash = get_file_hash(path)
+    with _uploads_lock:
+        uploaded = _uploaded_files.get(file_hash)
+        if uploaded and _expires_at(uploaded) - datetime.now(timezone.utc) > timedelta(seconds=GEMINI_FILE_EXPIRY_MARGIN_SECONDS):
+            return uploaded
+
+        pending = _pending_uploads.get(file_hash)
+        owner = pending is None
+        if owner:
+            pending = _pending_uploads[file_hash] = Future()
+
+    if not owner:
+        return pending.result()
+
+    try:
+        uploaded = get_client().files.upload(file=path)
+        with _uploads_lock:
+            _uploaded_files[file_hash] = uploaded
+        pending.set_result(uploaded)
+        return uploaded
+    except Exception as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _uploads_lock:
+            _pending_uploads.pop(file_hash, None)
 
-class StampDetectionResult(BaseModel):
-    document_type: Literal["pdf", "image"]
-    filename: str
-    stamp_coordinates: List[StampCoordinate]
 
-client = genai.Client(api_key=os.environ.get("GOOGLE_API_KEY", ""))
-llm = ChatGroq(
-    model="llama-3.3-70b-versatile",
-    max_retries=3,
-    temperature=0.1,
-)
+def _expires_at(uploaded: types.File) -> datetime:
+    # Files are kept 48 hours when the response does not say otherwise
+    return uploaded.expiration_time or (uploaded.create_time or datetime.now(timezone.utc)) + timedelta(hours=48)
 
 
 async def get_file_content(file_path: str, template_type: str = None) -> dict | None:
-    myfile = client.files.upload(file=file_path)
-    llm_with_parser = llm.with_structured_output(PunishmentLetter)
-    if template_type:
-        llm_with_parser = llm.with_structured_output(document_models.get(template_type, PunishmentLetter))
+    myfile = upload_file(file_path)
+    llm_with_parser = get_structured_llm(document_models.get(template_type, PunishmentLetter) if template_type else PunishmentLetter)
 
     try:
-        response = client.models.generate_content(
+        response = get_client().models.generate_content(
             model="gemini-2.0-flash", contents=[TEXT_EXTRACTION_PROMPT, myfile]
         )
         extracted_text = response.text
@@ -54,10 +109,10 @@ async def get_file_content(file_path: str, template_type: str = None) -> dict |
 
 
 async def document_classification(doc_path: str) -> dict:
-    myfile = client.files.upload(file=doc_path)
-    structured_llm = llm.with_structured_output(DocumentClassificationResult)
+    myfile = upload_file(doc_path)
+    structured_llm = get_structured_llm(DocumentClassificationResult)
 
-    response = client.models.generate_content(
+    response = get_client().models.generate_content(
             model="gemini-2.0-flash", contents=[document_classification_prompt, myfile]
         )
     extracted_text = response.text
@@ -72,12 +127,12 @@ async def document_classification(doc_path: str) -> dict:
 
 
 async def extract_json(doc_path: str, template_type: str = "ProbationLetter", stamp_reference_path: str = "ProjectData//AllMasterStamps-1.pdf") -> dict:
-    document_file = client.files.upload(file=doc_path)
-    stamp_reference_file = client.files.upload(file=stamp_reference_path)
+    document_file = upload_file(doc_path)
+    stamp_reference_file = upload_file(stamp_reference_path)
 
-    structured_llm = llm.with_structured_output(document_models.get(template_type))
+    structured_llm = get_structured_llm(document_models.get(template_type))
 
-    response = client.models.generate_content(
+    response = get_client().models.generate_content(
         model="gemini-2.0-flash",
         contents=[
             extract_json_prompt,
@@ -95,9 +150,12 @@ async def extract_json(doc_path: str, template_type: str = "ProbationLetter", st
     
 
 
-async def get_file_coordinates(file_path: str, stamp_reference_path: str = "ProjectData//AllMasterStamps-1.pdf"):
-    myfile = client.files.upload(file=file_path)
-    sample_file = client.files.upload(file=stamp_reference_path)
+def get_file_coordinates(file_path: str, stamp_reference_path: str = "ProjectData//AllMasterStamps-1.pdf"):
+    """
+    Blocking: uploads both files and waits for two LLM calls. Run it in a worker thread from async code.
+    """
+    myfile = upload_file(file_path)
+    sample_file = upload_file(stamp_reference_path)
     prompt = """
         Identify all official stamp marks on this document. For each stamp, return:
         - Page number (if multi-page)
@@ -124,11 +182,11 @@ async def get_file_coordinates(file_path: str, stamp_reference_path: str = "Proj
           - Use sample file as reference for stamp types
     """
 
-    response = client.models.generate_content(
+    response = get_client().models.generate_content(
                     model="gemini-2.0-flash", contents=[prompt, sample_file, myfile]
                 )
     
-    struct_llm = llm.with_structured_output(StampDetectionResult)
+    struct_llm = get_structured_llm(StampDetectionResult)
 
     coordinates = struct_llm.invoke(response.text)
     return coordinates
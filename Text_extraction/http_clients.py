@@ -0,0 +1,82 @@
+from constants import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY_SECONDS, LLM_TIMEOUT_SECONDS
+
+import importlib.util
+import threading
+import asyncio
+import httpx
+import os
+
+
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Hosts the warm-up connects to, per provider
+PROVIDER_BASE_URLS = {
+    "azure": os.environ.get("AZURE_OPENAI_ENDPOINT"),
+    "gemini": "https://generativelanguage.googleapis.com",
+    "groq": "https://api.groq.com"
+}
+
+# provider -> shared client, so every LLM client of a provider reuses the same connections
+_clients: dict[str, httpx.Client] = {}
+_async_clients: dict[str, httpx.AsyncClient] = {}
+_clients_lock = threading.Lock()
+
+
+def http_client_args() -> dict:
+    """
+    Connection settings of the shared clients: keep-alive pool limits and HTTP/2 when available.
+    Also passed to SDKs that build their own httpx client.
+    """
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+        )
+    }
+
+
+def get_http_client(provider: str) -> httpx.Client:
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = httpx.Client(timeout=LLM_TIMEOUT_SECONDS, **http_client_args())
+        return _clients[provider]
+
+
+def get_async_http_client(provider: str) -> httpx.AsyncClient:
+    with _clients_lock:
+        if provider not in _async_clients:
+            _async_clients[provider] = httpx.AsyncClient(timeout=LLM_TIMEOUT_SECONDS, **http_client_args())
+        return _async_clients[provider]
+
+
+async def warm_up_http_clients(providers: list[str]) -> None:
+    """
+    Opens a connection (TCP and TLS handshake) of each provider's async client, so the
+    first LLM call does not pay for it. Any HTTP status counts as connected.
+    """
+    async def ping(provider: str) -> None:
+        base_url = PROVIDER_BASE_URLS.get(provider)
+        if not base_url:
+            return
+        try:
+            response = await get_async_http_client(provider).head(base_url, timeout=10.0)
+            print(f"Connected to {provider} ({response.http_version})")
+        except Exception as e:
+            print(f"Warm-up ping of {provider} failed: {e!r}")
+
+    await asyncio.gather(*(ping(provider) for provider in providers))
+
+
+async def close_http_clients() -> None:
+    with _clients_lock:
+        clients, async_clients = list(_clients.values()), list(_async_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+
+    for client in clients:
+        client.close()
+    for async_client in async_clients:
+        await async_client.aclose()
@@ -0,0 +1,326 @@
+from constants import LLM_PROVIDERS, LLM_TIMEOUT_SECONDS, LLM_HEDGING, LLM_HEDGE_DELAY_MS
+from constants import LLM_RATE_LIMITS, LLM_OUTPUT_TOKENS_ESTIMATE
+from Text_extraction.rate_limit import ProviderLimiter, estimate_message_tokens
+from Text_extraction.http_clients import get_http_client, get_async_http_client
+from Text_extraction.tracing import trace_llm_call
+from metrics import record_llm_call
+
+from pydantic import BaseModel
+from collections import defaultdict, deque
+from typing import Any, Literal, Union, get_args, get_origin
+import asyncio
+import random
+import types
+import time
+
+
+class LLMProvider:
+    """
+    One chat model behind the router. Subclasses only build the LangChain chat model,
+    which happens on first use so that unused providers need no credentials.
+    Providers with an entry in LLM_RATE_LIMITS get a client side limiter.
+    """
+    model_name = ""
+
+    def __init__(self, name: str, weight: float = 1.0):
+        self.name = name
+        self.weight = weight
+        self.latencies = deque(maxlen=200)  # seconds of the recent successful calls
+        self.limiter = ProviderLimiter(**LLM_RATE_LIMITS[name]) if name in LLM_RATE_LIMITS else None
+        self._chat_model = None
+        self._structured_models = {}  # schema -> structured output runnable of chat_model
+
+    def build_chat_model(self):
+        raise NotImplementedError
+
+    @property
+    def chat_model(self):
+        if self._chat_model is None:
+            self._chat_model = self.build_chat_model()
+        return self._chat_model
+
+    def structured_model(self, schema: type[BaseModel]):
+        """
+        Structured output runnable of the schema, built once: building it converts the
+        pydantic model to a JSON schema, which is slow for the large document models.
+        """
+        structured_llm = self._structured_models.get(schema)
+        if structured_llm is None:
+            # include_raw keeps the AIMessage, its usage_metadata carries the token counts
+            structured_llm = self.chat_model.with_structured_output(schema, include_raw=True)
+            self._structured_models[schema] = structured_llm
+        return structured_llm
+
+    def warm_up(self, schemas: list[type[BaseModel]]) -> None:
+        for schema in schemas:
+            self.structured_model(schema)
+
+    async def ainvoke_structured(self, schema: type[BaseModel], messages: list, config: dict | None = None) -> BaseModel:
+        start = time.perf_counter()
+        try:
+            response = await self.structured_model(schema).ainvoke(messages, config=config)
+            if response["parsing_error"] is not None:
+                raise response["parsing_error"]
+        except Exception as e:
+            trace_llm_call(self.name, self.model_name, schema, messages, None, None, time.perf_counter() - start, e)
+            raise
+
+        seconds = time.perf_counter() - start
+        usage_metadata = getattr(response["raw"], "usage_metadata", None)
+        record_usage(self.name, schema.__name__, usage_metadata)
+        record_llm_call(self.name, schema, response["parsed"], usage_metadata, seconds)
+        trace_llm_call(self.name, self.model_name, schema, messages, response["parsed"], usage_metadata, seconds)
+        return response["parsed"]
+
+    def latency_p95(self) -> float | None:
+        if len(self.latencies) < 20:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+
+class AzureOpenAIProvider(LLMProvider):
+    model_name = "gpt-4o"
+
+    def build_chat_model(self):
+        from langchain_openai import AzureChatOpenAI
+
+        return AzureChatOpenAI(
+            deployment_name="gpt-4o",
+            model=self.model_name,
+            temperature=0.0,
+            api_version="2025-01-01-preview",
+            max_retries=0,  # throttling and transient errors are retried by the provider limiter
+            http_client=get_http_client(self.name),
+            http_async_client=get_async_http_client(self.name)
+        )
+
+
+class GeminiProvider(LLMProvider):
+    model_name = "gemini-2.0-flash"
+
+    def build_chat_model(self):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        # Talks gRPC (HTTP/2, kept alive) over one channel per chat model, there is no httpx client to share
+        return ChatGoogleGenerativeAI(model=self.model_name, temperature=0, max_retries=0)
+
+
+class FakeProvider(LLMProvider):
+    """
+    Offline provider. Returns `responses[schema]` (an instance, a dict or a callable
+    taking the messages) or else the smallest instance the schema accepts.
+    Latency and failures can be injected to exercise failover and hedging.
+    """
+    model_name = "fake"
+
+    def __init__(self, name: str = "fake", weight: float = 1.0, responses: dict | None = None,
+                 latency: float = 0.0, error: Exception | None = None):
+        super().__init__(name, weight)
+        self.responses = responses or {}
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    def warm_up(self, schemas: list[type[BaseModel]]) -> None:
+        pass
+
+    async def ainvoke_structured(self, schema: type[BaseModel], messages: list, config: dict | None = None) -> BaseModel:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error:
+            raise self.error
+
+        response = self.responses.get(schema)
+        if callable(response) and not isinstance(response, type):
+            response = response(messages)
+        if not isinstance(response, BaseModel):
+            response = schema.model_validate(response if response is not None else fake_value(schema))
+        record_llm_call(self.name, schema, response, None, self.latency)
+        return response
+
+
+# (provider, schema) -> token counts reported by the provider
+usage_stats = defaultdict(lambda: {
+    "calls": 0,
+    "input_tokens": 0,
+    "cached_input_tokens": 0,
+    "output_tokens": 0
+})
+
+
+def record_usage(provider_name: str, schema_name: str, usage_metadata: dict | None) -> None:
+    usage_metadata = usage_metadata or {}
+    stats = usage_stats[(provider_name, schema_name)]
+    stats["calls"] += 1
+    stats["input_tokens"] += usage_metadata.get("input_tokens", 0)
+    stats["cached_input_tokens"] += (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    stats["output_tokens"] += usage_metadata.get("output_tokens", 0)
+
+
+def get_usage_stats() -> dict:
+    """
+    Token usage per provider and schema, with the share of input tokens served from
+    the provider's prompt cache.
+    """
+    report = {}
+    for (provider_name, schema_name), stats in usage_stats.items():
+        report.setdefault(provider_name, {})[schema_name] = {
+            **stats,
+            "cache_hit_ratio": stats["cached_input_tokens"] / stats["input_tokens"] if stats["input_tokens"] else None
+        }
+    return report
+
+
+def fake_value(annotation: Any) -> Any:
+    """
+    Smallest value accepted for a type annotation: first literal, first union member,
+    0/""/[] for builtins and the required and nested model fields of a pydantic model.
+    """
+    origin = get_origin(annotation)
+    if origin is Literal:
+        return get_args(annotation)[0]
+    if origin in (Union, types.UnionType):
+        return fake_value(get_args(annotation)[0])
+    if origin in (list, tuple, set):
+        return []
+    if origin is dict:
+        return {}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {
+            field.alias or name: fake_value(field.annotation)
+            for name, field in annotation.model_fields.items()
+            if field.is_required() or (isinstance(field.annotation, type) and issubclass(field.annotation, BaseModel))
+        }
+    return {str: "", int: 0, float: 0.0, bool: False}.get(annotation)
+
+
+PROVIDER_CLASSES = {
+    "azure": AzureOpenAIProvider,
+    "gemini": GeminiProvider,
+    "fake": FakeProvider
+}
+
+
+class ProviderRouter:
+    """
+    Routes structured LLM calls over weighted providers.
+    - The first provider is drawn by weight, the others follow as failover in weight order.
+    - A call that raises or exceeds `timeout` seconds fails over to the next provider.
+    - With hedging, when the current provider has not answered within its p95 latency
+      (or `hedge_delay` seconds until enough calls were seen), the same request is also
+      sent to the next provider and the first successful answer wins.
+    """
+
+    def __init__(self, providers: list[LLMProvider], timeout: float = LLM_TIMEOUT_SECONDS,
+                 hedging: bool = LLM_HEDGING, hedge_delay: float = LLM_HEDGE_DELAY_MS / 1000):
+        if not providers:
+            raise ValueError("At least one LLM provider is required.")
+        self.providers = providers
+        self.timeout = timeout
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+
+    @property
+    def model_name(self) -> str:
+        return ",".join(f"{provider.name}:{provider.model_name}" for provider in self.providers)
+
+    def warm_up(self, schemas: list[type[BaseModel]]) -> None:
+        """
+        Builds the structured output runnables of every provider ahead of the first request.
+        A provider that cannot be built (e.g. missing credentials) is reported and skipped.
+        """
+        for provider in self.providers:
+            try:
+                provider.warm_up(schemas)
+            except Exception as e:
+                print(f"Warm-up of LLM provider {provider.name} failed: {e!r}")
+
+    def provider_order(self) -> list[LLMProvider]:
+        providers = sorted(self.providers, key=lambda provider: provider.weight, reverse=True)
+        primary = random.choices(providers, weights=[provider.weight for provider in providers])[0]
+        return [primary] + [provider for provider in providers if provider is not primary]
+
+    async def ainvoke_structured(self, schema: type[BaseModel], messages: list, config: dict | None = None) -> BaseModel:
+        order = self.provider_order()
+        errors = []
+        index = 0
+        while index < len(order):
+            provider = order[index]
+            backup = order[index + 1] if self.hedging and index + 1 < len(order) else None
+            try:
+                if backup:
+                    return await self._hedged_call(provider, backup, schema, messages, config)
+                return await self._call(provider, schema, messages, config)
+            except Exception as e:
+                print(f"LLM provider {provider.name} failed{' (hedged with ' + backup.name + ')' if backup else ''}: {e!r}")
+                errors.append(e)
+            # A failed hedged pair used both providers
+            index += 2 if backup else 1
+
+        raise errors[-1]
+
+    async def _call(self, provider: LLMProvider, schema: type[BaseModel], messages: list, config: dict | None,
+                    admitted: asyncio.Event | None = None) -> BaseModel:
+        """
+        :param admitted: Set when the request is sent, after waiting for the provider limiter.
+        """
+        async def attempt() -> BaseModel:
+            if admitted:
+                admitted.set()
+            start = time.perf_counter()
+            response = await asyncio.wait_for(provider.ainvoke_structured(schema, messages, config), self.timeout)
+            provider.latencies.append(time.perf_counter() - start)
+            return response
+
+        if provider.limiter is None:
+            return await attempt()
+
+        # Waiting for the limiter does not count against the timeout, queued calls wait rather than fail
+        estimated_tokens = await asyncio.to_thread(estimate_message_tokens, messages)
+        return await provider.limiter.run(attempt, estimated_tokens + LLM_OUTPUT_TOKENS_ESTIMATE)
+
+    async def _hedged_call(self, primary: LLMProvider, backup: LLMProvider, schema: type[BaseModel],
+                           messages: list, config: dict | None) -> BaseModel:
+        admitted = asyncio.Event()
+        primary_task = asyncio.create_task(self._call(primary, schema, messages, config, admitted))
+        # The hedge budget starts once the limiter lets the primary request through, not while it queues
+        admission = asyncio.create_task(admitted.wait())
+        await asyncio.wait({primary_task, admission}, return_when=asyncio.FIRST_COMPLETED)
+        admission.cancel()
+
+        budget = primary.latency_p95() or self.hedge_delay
+        done, _ = await asyncio.wait({primary_task}, timeout=budget)
+        if done and primary_task.exception() is None:
+            return primary_task.result()
+
+        backup_task = asyncio.create_task(self._call(backup, schema, messages, config))
+        pending = {task for task in (primary_task, backup_task) if not task.done()}
+        error = primary_task.exception() if primary_task.done() else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def parse_providers(spec: str) -> list[LLMProvider]:
+    """
+    Parses a provider list like "azure:3,gemini:1" (name:weight, weight defaults to 1).
+    """
+    providers = []
+    for entry in filter(None, (item.strip() for item in spec.split(","))):
+        name, _, weight = entry.partition(":")
+        if name not in PROVIDER_CLASSES:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        providers.append(PROVIDER_CLASSES[name](name, float(weight or 1)))
+    return providers
+
+
+llm_router = ProviderRouter(parse_providers(LLM_PROVIDERS))
@@ -0,0 +1,197 @@
+from constants import LLM_MAX_RETRIES, LLM_TRANSIENT_RETRIES, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS
+
+from PIL import Image
+from typing import Awaitable, Callable
+import asyncio
+import base64
+import random
+import math
+import time
+import io
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    Estimates the input tokens of a high detail image for GPT-4o style models:
+    fit into 2048x2048, shortest side scaled to 768, then 170 tokens per 512px tile plus 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def content_image_tokens(message_content: list) -> int:
+    tokens = 0
+    for block in message_content:
+        if block["type"] == "image_url":
+            encoded = block["image_url"]["url"].split(",", 1)[1]
+            image = Image.open(io.BytesIO(base64.b64decode(encoded)))
+            tokens += estimate_image_tokens(*image.size)
+    return tokens
+
+
+def estimate_message_tokens(messages: list) -> int:
+    """
+    Rough input token count of chat messages, ~4 characters per text token plus image tokens.
+    """
+    tokens = 0
+    for message in messages:
+        content = message["content"] if isinstance(message, dict) else message.content
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        tokens += sum(len(block["text"]) // 4 for block in content if block["type"] == "text")
+        tokens += content_image_tokens(content)
+    return tokens
+
+
+class TokenBucket:
+    """
+    Allows `rate_per_minute` units per minute with bursts up to the same amount.
+    acquire waits until enough units are available instead of failing.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.rate_per_second = rate_per_minute / 60
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1) -> None:
+        # A request larger than the bucket could never run, let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by 1/limit per successful call (about +1 per round of
+    calls) and halves when the provider throttles. Other failures leave it unchanged.
+    Callers over the limit wait in line.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, succeeded: bool, throttled: bool = False) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+# Throttling exceptions of the provider SDKs: openai/groq RateLimitError, google.api_core ResourceExhausted
+THROTTLE_ERROR_NAMES = {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+# Server errors, timeouts and dropped connections of the SDKs (openai, google.api_core, httpx) and the standard library
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "InternalServerError", "ServiceUnavailable", "DeadlineExceeded",
+    "TransportError", "TimeoutError", "ConnectionError"
+}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+
+def error_names(error: Exception) -> set[str]:
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def error_status_codes(error: Exception) -> set[int]:
+    """
+    HTTP status of an SDK exception, from status_code, response.status_code or code.
+    """
+    status_codes = (
+        getattr(error, "status_code", None),
+        getattr(getattr(error, "response", None), "status_code", None),
+        getattr(error, "code", None)
+    )
+    return {int(status_code) for status_code in status_codes if isinstance(status_code, int)}
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """
+    True when the provider answered 429 Too Many Requests, judged by the exception type or
+    its HTTP status, never by the message text.
+    """
+    return bool(error_names(error) & THROTTLE_ERROR_NAMES) or 429 in error_status_codes(error)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    True for failures worth retrying as they are: 5xx answers, timeouts and connection errors.
+    """
+    return bool(error_names(error) & TRANSIENT_ERROR_NAMES or error_status_codes(error) & TRANSIENT_STATUS_CODES)
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderLimiter:
+    """
+    Client side limits of one provider deployment: requests and tokens per minute,
+    adaptive concurrency and retries with jittered exponential backoff, up to `max_retries`
+    for throttled calls and `max_transient_retries` for transient failures (see is_transient_error).
+    The SDK clients do not retry themselves.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, max_concurrency: int,
+                 max_retries: int = LLM_MAX_RETRIES, max_transient_retries: int = LLM_TRANSIENT_RETRIES):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrencyLimiter(initial=max(1, max_concurrency // 2), maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.max_transient_retries = max_transient_retries
+
+    async def run(self, call: Callable[[], Awaitable], estimated_tokens: int = 0):
+        throttle_retries, transient_retries = 0, 0
+        while True:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            await self.concurrency.acquire()
+            succeeded, throttled = False, False
+            try:
+                response = await call()
+                succeeded = True
+                return response
+            except Exception as e:
+                throttled = is_throttle_error(e)
+                if throttled and throttle_retries < self.max_retries:
+                    throttle_retries += 1
+                    retry, max_retries, reason = throttle_retries, self.max_retries, "throttled"
+                elif not throttled and is_transient_error(e) and transient_retries < self.max_transient_retries:
+                    transient_retries += 1
+                    retry, max_retries, reason = transient_retries, self.max_transient_retries, f"failed ({e!r})"
+                else:
+                    raise
+                delay = retry_after_seconds(e) or min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** (retry - 1))
+                delay *= random.uniform(0.5, 1.5)
+                print(f"LLM call {reason}, retry {retry}/{max_retries} in {delay:.1f}s")
+            finally:
+                await self.concurrency.release(succeeded, throttled)
+            await asyncio.sleep(delay)
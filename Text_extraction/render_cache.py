@@ -0,0 +1,224 @@
+from constants import RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES, RENDER_PROCESSES
+from Text_extraction.result_cache import file_sha256
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
+import fitz
+import os
+
+
+# path -> (mtime, size, sha256), so a file is hashed once until it changes
+_file_hashes = {}
+_cache_lock = threading.Lock()
+_cache_size: int | None = None
+_render_pool: ProcessPoolExecutor | None = None
+_render_pool_lock = threading.Lock()
+
+
+def get_file_hash(path: str) -> str:
+    stat = os.stat(path)
+    cached = _file_hashes.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = file_sha256(path)
+    _file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def render_page(path: str, page_index: int, dpi: int = 150, image_format: str = "png",
+                file_hash: str | None = None, doc: fitz.Document | None = None) -> bytes:
+    """
+    Returns the encoded image of a PDF page, rendering it only on a cache miss.
+    Renders are stored under RENDER_CACHE_DIR keyed by (file hash, page, dpi, format).
+    :param doc: Already opened document, avoids re-opening the file for every page.
+    """
+    file_hash = file_hash or get_file_hash(path)
+    cache_path = _cache_path(file_hash, page_index, dpi, image_format)
+
+    image_bytes = read_cached_render(file_hash, page_index, dpi, image_format)
+    if image_bytes is not None:
+        return image_bytes
+
+    if doc is None:
+        image_bytes = _render_page_worker(path, page_index, dpi, image_format)
+    else:
+        image_bytes = doc[page_index].get_pixmap(dpi=dpi).tobytes(image_format)
+
+    store_render(cache_path, image_bytes)
+    return image_bytes
+
+
+def render_pages(path: str, page_indexes: list[int], dpi: int = 150, image_format: str = "png",
+                 file_hash: str | None = None) -> list[bytes]:
+    """
+    Returns the encoded images of several PDF pages, in the order of `page_indexes`.
+    Cached pages are read from disk, the others are rendered in parallel in the render
+    process pool, one task per page.
+    """
+    file_hash = file_hash or get_file_hash(path)
+    results = {}
+    missing = []
+    for page_index in page_indexes:
+        image_bytes = read_cached_render(file_hash, page_index, dpi, image_format)
+        if image_bytes is None:
+            missing.append(page_index)
+        else:
+            results[page_index] = image_bytes
+
+    if len(missing) == 1:
+        results[missing[0]] = render_page(path, missing[0], dpi, image_format, file_hash)
+    elif missing:
+        for page_index, image_bytes in zip(missing, _render_in_pool(path, missing, dpi, image_format)):
+            results[page_index] = image_bytes
+            store_render(_cache_path(file_hash, page_index, dpi, image_format), image_bytes)
+
+    return [results[page_index] for page_index in page_indexes]
+
+
+def read_cached_render(file_hash: str, page_index: int, dpi: int = 150, image_format: str = "png") -> bytes | None:
+    """
+    Returns the encoded image of a page from the cache, None on a miss.
+    """
+    cache_path = _cache_path(file_hash, page_index, dpi, image_format)
+    try:
+        with open(cache_path, "rb") as f:
+            image_bytes = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        # Reads refresh the mtime, eviction removes the least recently used renders first
+        os.utime(cache_path)
+    except FileNotFoundError:
+        pass
+    return image_bytes
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Forking a server process that runs threads is not safe, so workers come from a
+            # forkserver (spawn on Windows). Both re-import the parent's __main__ module as
+            # __mp_main__ in every worker: entry scripts must keep their side effects under
+            # `if __name__ == "__main__":` or in startup hooks.
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _render_pool = ProcessPoolExecutor(
+                max_workers=RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context(start_method)
+            )
+        return _render_pool
+
+
+def reset_render_pool(broken_pool: ProcessPoolExecutor) -> None:
+    """
+    Drops a pool that lost a worker (e.g. killed for running out of memory), which fails
+    every later task. The next get_render_pool starts a new one.
+    """
+    global _render_pool
+
+    with _render_pool_lock:
+        if _render_pool is broken_pool:
+            _render_pool = None
+    broken_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_in_pool(path: str, page_indexes: list[int], dpi: int, image_format: str) -> list[bytes]:
+    # A broken pool is replaced and the pages retried once, a page that breaks the new pool too raises
+    for attempt in range(2):
+        pool = get_render_pool()
+        try:
+            futures = [pool.submit(_render_page_worker, path, page_index, dpi, image_format) for page_index in page_indexes]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            reset_render_pool(pool)
+            if attempt:
+                raise
+            print(f"Render process pool broken, restarting it to render {os.path.basename(path)}")
+
+
+def _render_page_worker(path: str, page_index: int, dpi: int, image_format: str) -> bytes:
+    with fitz.open(path) as doc:
+        return doc[page_index].get_pixmap(dpi=dpi).tobytes(image_format)
+
+
+def store_render(cache_path: str, image_bytes: bytes) -> None:
+    global _cache_size
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(image_bytes)
+    os.replace(temp_path, cache_path)
+
+    with _cache_lock:
+        if _cache_size is None:
+            _cache_size = sum(size for _, size, _ in _cache_entries())
+        else:
+            _cache_size += len(image_bytes)
+
+        if _cache_size > RENDER_CACHE_MAX_BYTES:
+            _cache_size = evict_renders(int(RENDER_CACHE_MAX_BYTES * 0.9))
+
+
+def evict_renders(target_bytes: int) -> int:
+    """
+    Deletes the least recently used renders until the cache is at most `target_bytes`.
+    :return: Size of the cache after eviction.
+    """
+    entries = sorted(_cache_entries())
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(entry_path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def _cache_path(file_hash: str, page_index: int, dpi: int, image_format: str) -> str:
+    return os.path.join(RENDER_CACHE_DIR, file_hash[:2], f"{file_hash}_{page_index}_{dpi}.{image_format}")
+
+
+def _cache_entries() -> list[tuple[float, int, str]]:
+    entries = []
+    for root, _, files in os.walk(RENDER_CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            entry_path = os.path.join(root, name)
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+    return entries
+
+
+if __name__ == "__main__":
+    # Serial vs process pool rendering, bypassing the cache: python -m Text_extraction.render_cache <file.pdf>
+    import sys
+    import time
+
+    pdf_path = sys.argv[1]
+    with fitz.open(pdf_path) as document:
+        page_count = len(document)
+
+    start = time.perf_counter()
+    for index in range(page_count):
+        _render_page_worker(pdf_path, index, 150, "png")
+    serial = time.perf_counter() - start
+
+    pool = get_render_pool()
+    list(pool.map(_render_page_worker, [pdf_path] * page_count, range(page_count), [150] * page_count, ["png"] * page_count))  # start the workers
+    start = time.perf_counter()
+    list(pool.map(_render_page_worker, [pdf_path] * page_count, range(page_count), [150] * page_count, ["png"] * page_count))
+    parallel = time.perf_counter() - start
+
+    print(f"{page_count} pages: serial {serial * 1000:.0f} ms, process pool {parallel * 1000:.0f} ms ({serial / parallel:.1f}x)")
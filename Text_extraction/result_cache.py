@@ -0,0 +1,106 @@
+from MongoDB.database import get_cached_extraction, upsert_cached_extraction, clear_extraction_cache, create_extraction_cache_indexes
+from constants import EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_PERSISTENT, EXTRACTION_CACHE_TTL_DAYS
+
+from pydantic import BaseModel
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import hashlib
+import copy
+import json
+
+
+# In-memory LRU tier in front of the MongoDB tier
+_memory_cache: OrderedDict = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def prompt_version(*prompts: str) -> str:
+    """
+    Version of the prompts used for a call. Any edit in prompts.py changes it,
+    so results produced with an older prompt are never served.
+    """
+    return hashlib.sha256("\x00".join(prompts).encode("utf-8")).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def schema_version(model: type[BaseModel]) -> str:
+    """
+    Version of the output schema. Any change of the model in models.py changes it.
+    """
+    schema = json.dumps(model.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+
+
+def extraction_cache_key(kind: str, file_hash: str, document_type: str | None, model_name: str,
+                         prompts: list[str], schema: type[BaseModel]) -> str:
+    return ":".join([
+        kind,
+        file_hash,
+        document_type or "-",
+        model_name,
+        prompt_version(*prompts),
+        schema_version(schema)
+    ])
+
+
+def get_cached_result(key: str) -> dict | None:
+    """
+    Looks the key up in memory, then in MongoDB. A persistent hit is promoted to memory.
+    Returns a copy, callers are free to modify it.
+    """
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return copy.deepcopy(_memory_cache[key])
+
+    if not EXTRACTION_CACHE_PERSISTENT:
+        return None
+
+    result = get_cached_extraction(key)
+    if result is None:
+        return None
+
+    _remember(key, result)
+    return copy.deepcopy(result)
+
+
+def set_cached_result(key: str, result: dict) -> None:
+    result = copy.deepcopy(result)
+    _remember(key, result)
+    if EXTRACTION_CACHE_PERSISTENT:
+        upsert_cached_extraction(key, result)
+
+
+def prepare_persistent_cache() -> None:
+    """
+    Indexes the MongoDB tier, run once at startup.
+    """
+    if EXTRACTION_CACHE_PERSISTENT:
+        create_extraction_cache_indexes(EXTRACTION_CACHE_TTL_DAYS * 24 * 60 * 60)
+
+
+def invalidate_cache() -> None:
+    """
+    Drops every cached result from both tiers.
+    """
+    with _memory_cache_lock:
+        _memory_cache.clear()
+    if EXTRACTION_CACHE_PERSISTENT:
+        clear_extraction_cache()
+
+
+def _remember(key: str, result: dict) -> None:
+    with _memory_cache_lock:
+        _memory_cache[key] = result
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > EXTRACTION_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
@@ -0,0 +1,179 @@
+from constants import TRACE_SAMPLE_RATE, TRACE_IMAGES, TRACE_QUEUE_SIZE, TRACE_BATCH_SIZE, TRACE_FLUSH_SECONDS
+from constants import LANGFUSE_SECRET_KEY, LANGFUSE_PUBLIC_KEY, LANGFUSE_HOST
+from metrics import TRACES_DROPPED
+
+from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import Callable
+import threading
+import hashlib
+import random
+import queue
+
+
+class TraceExporter:
+    """
+    Exports traces in batches from a daemon thread. submit hashes or strips the images
+    before queueing, so the bounded queue never holds the base64 page images, and the
+    export happens on the thread. When the queue is full the trace is dropped.
+    """
+
+    def __init__(self, export: Callable[[list[dict]], None], max_queue: int = TRACE_QUEUE_SIZE,
+                 batch_size: int = TRACE_BATCH_SIZE, flush_seconds: float = TRACE_FLUSH_SECONDS):
+        self.export = export
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, record: dict) -> None:
+        self._ensure_thread()
+        try:
+            if self.queue.full():
+                raise queue.Full
+            self.queue.put_nowait(sanitise_record(record))
+        except queue.Full:
+            self.dropped += 1
+            TRACES_DROPPED.inc()
+        except Exception as e:
+            print(f"Trace dropped, the call data could not be copied: {e!r}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = []
+            stop = False
+            try:
+                record = self.queue.get(timeout=self.flush_seconds)
+                while record is not None:
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        break
+                    record = self.queue.get_nowait()
+                stop = record is None
+            except queue.Empty:
+                pass
+
+            if batch:
+                try:
+                    self.export(batch)
+                except Exception as e:
+                    print(f"Trace export failed, {len(batch)} traces lost: {e!r}")
+            if stop:
+                return
+
+
+def sanitise_record(record: dict) -> dict:
+    output = record["output"]
+    return {
+        **record,
+        "input": [sanitise_message(message) for message in record["input"]],
+        "output": output.model_dump() if isinstance(output, BaseModel) else output
+    }
+
+
+def sanitise_message(message) -> dict:
+    """
+    Copy of a chat message with every inline image replaced by its hash (TRACE_IMAGES="hash")
+    or removed (TRACE_IMAGES="strip").
+    """
+    if not isinstance(message, dict):
+        message = {"role": getattr(message, "type", None), "content": message.content}
+    content = message["content"]
+    if isinstance(content, str):
+        return {"role": message["role"], "content": content}
+
+    blocks = []
+    for block in content:
+        if block.get("type") != "image_url":
+            blocks.append(block)
+            continue
+        if TRACE_IMAGES == "strip":
+            continue
+        url = block["image_url"]["url"]
+        blocks.append({
+            "type": "image_url",
+            "image_url": {"url": f"sha256:{hashlib.sha256(url.encode('utf-8')).hexdigest()}", "size": len(url)}
+        })
+    return {"role": message["role"], "content": blocks}
+
+
+def export_to_langfuse(batch: list[dict]) -> None:
+    langfuse = get_langfuse()
+    for record in batch:
+        generation = langfuse.start_generation(
+            name=record["name"],
+            model=record["model"],
+            input=record["input"],
+            output=record["output"],
+            usage_details=record["usage_details"],
+            metadata=record["metadata"],
+            level="ERROR" if record["error"] else "DEFAULT",
+            status_message=record["error"]
+        )
+        generation.end()
+    langfuse.flush()
+
+
+_langfuse = None
+
+
+def get_langfuse():
+    global _langfuse
+
+    if _langfuse is None:
+        from langfuse import Langfuse
+
+        _langfuse = Langfuse(secret_key=LANGFUSE_SECRET_KEY, public_key=LANGFUSE_PUBLIC_KEY, host=LANGFUSE_HOST)
+    return _langfuse
+
+
+trace_exporter = TraceExporter(export_to_langfuse)
+
+# Without Langfuse credentials there is nowhere to export to
+TRACING_ENABLED = TRACE_SAMPLE_RATE > 0 and bool(LANGFUSE_SECRET_KEY and LANGFUSE_PUBLIC_KEY)
+
+
+def trace_llm_call(provider: str, model: str, schema: type[BaseModel], messages: list, response: BaseModel | None,
+                   usage_metadata: dict | None, seconds: float, error: Exception | None = None) -> None:
+    """
+    Queues a trace of one structured LLM call for TRACE_SAMPLE_RATE of the calls,
+    when the Langfuse keys are set. Never blocks and never raises.
+    """
+    if not TRACING_ENABLED or random.random() >= TRACE_SAMPLE_RATE:
+        return
+
+    usage_metadata = usage_metadata or {}
+    trace_exporter.submit({
+        "name": schema.__name__,
+        "model": model,
+        "input": messages,
+        "output": response,
+        "usage_details": {
+            "input": usage_metadata.get("input_tokens", 0),
+            "cache_read_input_tokens": (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0,
+            "output": usage_metadata.get("output_tokens", 0)
+        },
+        "metadata": {
+            "provider": provider,
+            "latency_seconds": round(seconds, 3),
+            "finished_at": datetime.now(timezone.utc).isoformat()
+        },
+        "error": repr(error) if error else None
+    })
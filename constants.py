@@ -1,13 +1,127 @@
+from dotenv import load_dotenv
+load_dotenv()  # before any setting below is read
+
+import tempfile
 import os
 
 
 UPLOAD_DIR = "uploads"
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_UPLOAD_FILE_SIZE = int(os.environ.get("MAX_UPLOAD_FILE_SIZE", 25 * 1024 * 1024))
+MAX_UPLOAD_REQUEST_SIZE = int(os.environ.get("MAX_UPLOAD_REQUEST_SIZE", 100 * 1024 * 1024))
+STAMP_REFERENCE_PATH = "ProjectData//AllMasterStamps-1.pdf"
+
+# Rendered PDF pages shared by every module, least recently used renders are evicted past the limit
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "document_analyzer", "render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 1024 * 1024 * 1024))  # 1 GB
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", os.cpu_count() or 1))  # processes rendering pages of one file in parallel
 
 # Replace with your actual MongoDB Atlas connection string
 MONGODB_URI = os.environ.get("MONGODB_URI", "mongodb://localhost:27017/")
 DATABASE_NAME = os.environ.get("DATABASE_NAME", "mydatabase")
 USER_COLLECTION_NAME = os.environ.get("USER_COLLECTION_NAME", "users")
 DATA_COLLECTION_NAME = os.environ.get("DATA_COLLECTION_NAME", "documents_data")
+JOB_COLLECTION_NAME = os.environ.get("JOB_COLLECTION_NAME", "upload_jobs")
+EXTRACTION_CACHE_COLLECTION_NAME = os.environ.get("EXTRACTION_CACHE_COLLECTION_NAME", "extraction_cache")
+
+# Background upload processing
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+FILE_CONCURRENCY = int(os.environ.get("FILE_CONCURRENCY", 4))  # files of one upload processed in parallel
+
+# Single call classify-and-extract mode
+COMBINED_EXTRACTION = os.environ.get("COMBINED_EXTRACTION", "false").lower() == "true"  # default for uploads
+COMBINED_MIN_CONFIDENCE = float(os.environ.get("COMBINED_MIN_CONFIDENCE", 0.6))  # below this the two step path is used
+
+# Extraction result cache
+EXTRACTION_CACHE_SIZE = int(os.environ.get("EXTRACTION_CACHE_SIZE", 256))  # entries kept in memory
+EXTRACTION_CACHE_PERSISTENT = os.environ.get("EXTRACTION_CACHE_PERSISTENT", "true").lower() == "true"
+EXTRACTION_CACHE_TTL_DAYS = int(os.environ.get("EXTRACTION_CACHE_TTL_DAYS", 0))  # MongoDB entries expire after this, 0 keeps them
+
+# Document classification passes as (max pages, dpi, max image edge in px), cheapest first.
+# A pass is only run when the previous one returned a confidence below CLASSIFICATION_MIN_CONFIDENCE.
+CLASSIFICATION_PASSES = [
+    (1, 72, 1024),
+    (None, 150, None)
+]
+CLASSIFICATION_MIN_CONFIDENCE = float(os.environ.get("CLASSIFICATION_MIN_CONFIDENCE", 0.8))
+
+# Born-digital PDF pages with at least TEXT_LAYER_MIN_CHARS characters of text are sent as text
+TEXT_LAYER_FAST_PATH = os.environ.get("TEXT_LAYER_FAST_PATH", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("TEXT_LAYER_MIN_CHARS", 200))
+
+# Send only the regions of DOCUMENT_LAYOUT_PROFILES to extraction, regions whose fields all come back empty are re-read from full pages
+ROI_EXTRACTION = os.environ.get("ROI_EXTRACTION", "false").lower() == "true"
+
+# LLM providers as "name:weight" pairs, e.g. "azure:3,gemini:1" ("fake" runs offline)
+LLM_PROVIDERS = os.environ.get("LLM_PROVIDERS", "azure:1")
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", 120))  # per attempt, then fail over
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "false").lower() == "true"
+LLM_HEDGE_DELAY_MS = int(os.environ.get("LLM_HEDGE_DELAY_MS", 30000))  # until a provider has a p95 latency
+
+# Client side limits per provider deployment, throttled and transiently failed calls are retried with jittered exponential backoff
+LLM_RATE_LIMITS = {
+    "azure": {
+        "requests_per_minute": int(os.environ.get("AZURE_OPENAI_RPM", 60)),
+        "tokens_per_minute": int(os.environ.get("AZURE_OPENAI_TPM", 150000)),
+        "max_concurrency": int(os.environ.get("AZURE_OPENAI_MAX_CONCURRENCY", 8))
+    },
+    "gemini": {
+        "requests_per_minute": int(os.environ.get("GEMINI_RPM", 60)),
+        "tokens_per_minute": int(os.environ.get("GEMINI_TPM", 1000000)),
+        "max_concurrency": int(os.environ.get("GEMINI_MAX_CONCURRENCY", 8))
+    }
+}
+LLM_OUTPUT_TOKENS_ESTIMATE = 2000  # reserved per call in the tokens per minute budget
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 5))  # of throttled calls
+LLM_TRANSIENT_RETRIES = int(os.environ.get("LLM_TRANSIENT_RETRIES", 2))  # of 5xx, timeouts and connection errors, as the SDKs did
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 60.0
+
+# USD per million tokens, used for the cost estimate of LLM calls in /metrics
+LLM_TOKEN_PRICES = {
+    "azure": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gemini": {"input": 0.10, "cached_input": 0.025, "output": 0.40}
+}
+
+# Sampled tracing of LLM calls to Langfuse, exported from a background thread
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 0.05))  # share of calls traced, 0 disables tracing
+TRACE_IMAGES = os.environ.get("TRACE_IMAGES", "hash")  # "hash" replaces images by their SHA-256, "strip" drops them
+TRACE_QUEUE_SIZE = int(os.environ.get("TRACE_QUEUE_SIZE", 1000))  # traces waiting for export, newer ones are dropped
+TRACE_BATCH_SIZE = 50
+TRACE_FLUSH_SECONDS = 5.0
+# Credentials are only read from the environment, tracing is off while they are unset
+LANGFUSE_SECRET_KEY = os.environ.get("LANGFUSE_SECRET_KEY")
+LANGFUSE_PUBLIC_KEY = os.environ.get("LANGFUSE_PUBLIC_KEY")
+LANGFUSE_HOST = os.environ.get("LANGFUSE_HOST", "http://20.102.104.3:3000")
+
+# Shared HTTP clients of the LLM providers
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))  # per provider
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SECONDS", 60))
+HTTP_WARMUP = os.environ.get("HTTP_WARMUP", "false").lower() == "true"  # connect to the providers at startup
+
+# Gemini file uploads, reused until this many seconds before the provider expires them
+GEMINI_FILE_EXPIRY_MARGIN_SECONDS = int(os.environ.get("GEMINI_FILE_EXPIRY_MARGIN_SECONDS", 600))
+
+# Local stamp detection on pages rendered at STAMP_DETECTION_DPI (image files are used as is)
+STAMP_DETECTION_DPI = 150
+STAMP_INK_HSV_RANGE = ((95, 50, 30), (165, 255, 110))  # OpenCV HSV (hue 0-180) of blue to violet ink
+STAMP_MIN_WIDTH = 0.08  # of the page width
+STAMP_MIN_HEIGHT = 0.04  # of the page width
+STAMP_MAX_ASPECT_RATIO = 5.0  # width / height, longer regions are lines of handwriting
+STAMP_MIN_INK_DENSITY = 0.07  # ink pixels / region pixels
+
+# /detect_stamps: crops are returned as thumbnails or stored under STAMP_CROP_DIR by their SHA-256
+STAMP_CROP_DIR = os.environ.get("STAMP_CROP_DIR", "stamps")
+STAMP_THUMBNAIL_EDGE = 256  # longest edge in pixels
+STAMP_DETECTION_CONCURRENCY = int(os.environ.get("STAMP_DETECTION_CONCURRENCY", 4))  # files of one request processed in parallel
+
+# Offline stamp index: master stamps matched locally instead of sending the stamp reference to the LLM
+STAMP_LIST_DIR = "USE CASE Number-6(Doc to Data)//Master Stamps_List"
+STAMP_INDEX_PATH = os.environ.get("STAMP_INDEX_PATH", "ProjectData//stamp_index.npz")  # built by python -m Image_extraction.stamp_index
+LOCAL_STAMP_MATCHING = os.environ.get("LOCAL_STAMP_MATCHING", "false").lower() == "true"
+STAMP_MATCH_MIN_VOTES = 20  # ORB descriptor matches of the winning stamp
+STAMP_MATCH_MIN_SHARE = 0.35  # of all votes of the crop
 
 # Secret key for JWT
 SECRET_KEY = "supersecretkey"
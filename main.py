@@ -1,20 +1,31 @@
-from models import UserModel, FileModel, FileFiltersModel, InsertUserFileModel, LoginModel
+from models import UserModel, FileModel, FileFiltersModel, InsertUserFileModel, LoginModel, DetectStampsModel
 from MongoDB.database import (
     user_authenticate, 
     insert_user, 
-    insert_user_file, 
     get_user_files, 
     update_user_file,
     check_mongodb_connection,
     get_file_data,
-    get_all_users_files
+    get_all_users_files,
+    get_job
 )
+from Text_extraction.result_cache import invalidate_cache, prepare_persistent_cache
 from constants import UPLOAD_DIR, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, REMEMBER_ACCESS_TOKEN_EXPIRE_MINUTES
+from constants import UPLOAD_CHUNK_SIZE, MAX_UPLOAD_FILE_SIZE, MAX_UPLOAD_REQUEST_SIZE, COMBINED_EXTRACTION, HTTP_WARMUP
+from constants import LOCAL_STAMP_MATCHING, STAMP_CROP_DIR, STAMP_DETECTION_CONCURRENCY
 from Validations.validate_forms import validation_functions
-from Text_extraction.extract_data import document_classification, extract_json
+from Text_extraction.extract_data import extract_json, get_stamp_reference_content, get_classification_stats, warm_up_structured_models
+from Text_extraction.providers import get_usage_stats, llm_router
+from Text_extraction.http_clients import warm_up_http_clients, close_http_clients
+from Text_extraction.tracing import trace_exporter
+from Jobs.job_queue import create_job, enqueue_job, start_job_workers
+from Image_extraction.stamp_index import get_stamp_index
+from Image_extraction.get_image_coord import get_stamp_coordinates, crop_stamps, stamp_thumbnail, store_stamp_crop
+from metrics import stage_span, metrics_response
 
 from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI, File, UploadFile, HTTPException, status, Security
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request, status, Security
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 from jose import JWTError, jwt
@@ -23,6 +34,7 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 from uuid import uuid4
 
+import asyncio
 import hashlib
 import uvicorn
 import os
@@ -32,9 +44,7 @@ load_dotenv()
 
 
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-
-check_mongodb_connection()
+os.makedirs(STAMP_CROP_DIR, exist_ok=True)
 
 
 app = FastAPI()
@@ -42,6 +52,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 api_key_header = APIKeyHeader(name="Authorization")
 
 app.mount("/uploads", StaticFiles(directory="uploads"), name="static")
+app.mount("/stamps", StaticFiles(directory=STAMP_CROP_DIR), name="stamps")
 
 app.add_middleware(
     CORSMiddleware,
@@ -52,6 +63,41 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def startup() -> None:
+    # Not at import: render workers re-import the entry module (see render_cache.get_render_pool)
+    await asyncio.to_thread(check_mongodb_connection)
+    await asyncio.to_thread(prepare_persistent_cache)
+    start_job_workers()
+    if LOCAL_STAMP_MATCHING:
+        await asyncio.to_thread(get_stamp_index)
+    else:
+        # Build the stamp reference payload once instead of on the first extraction
+        await asyncio.to_thread(get_stamp_reference_content)
+    await asyncio.to_thread(warm_up_structured_models)
+    if HTTP_WARMUP:
+        await warm_up_http_clients([provider.name for provider in llm_router.providers])
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await close_http_clients()
+    await asyncio.to_thread(trace_exporter.close)
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Reject oversized uploads from the declared length before the body is read. A chunked request
+    # without Content-Length would be read whole by Starlette before the handler can count it, so it is refused.
+    if request.url.path == "/upload_files" and request.method == "POST":
+        content_length = request.headers.get("content-length")
+        if not content_length or not content_length.isdigit():
+            return JSONResponse(status_code=411, content={"detail": "Content-Length is required for uploads."})
+        if int(content_length) > MAX_UPLOAD_REQUEST_SIZE:
+            return JSONResponse(status_code=413, content={"detail": f"Upload exceeds {MAX_UPLOAD_REQUEST_SIZE} bytes."})
+    return await call_next(request)
+
+
 # JWT Authentication
 auth_header = APIKeyHeader(name="Authorization")
 
@@ -138,81 +184,130 @@ async def register(user_data: UserModel) -> dict:
     return insert_user(user_data)
 
 
+async def save_upload_file(file: UploadFile, file_location: str, request_bytes_left: int) -> tuple[int, str]:
+    """
+    Streams an uploaded file to disk in UPLOAD_CHUNK_SIZE chunks, hashing it on the fly,
+    so that memory use does not grow with the file size.
+    Raises 413 as soon as the file exceeds MAX_UPLOAD_FILE_SIZE or the request budget.
+    :return: Tuple of the file size in bytes and its SHA-256 hex digest.
+    """
+    sha256 = hashlib.sha256()
+    file_size = 0
+    try:
+        with open(file_location, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_UPLOAD_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File {file.filename} exceeds {MAX_UPLOAD_FILE_SIZE} bytes.")
+                if file_size > request_bytes_left:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_REQUEST_SIZE} bytes.")
+                sha256.update(chunk)
+                f.write(chunk)
+    except HTTPException:
+        os.remove(file_location)
+        raise
+
+    return file_size, sha256.hexdigest()
+
+
 @app.post("/upload_files")
 async def upload_files(
     user_id: str = Security(get_current_user),
-    files: List[UploadFile] = File(default=[])
+    files: List[UploadFile] = File(default=[]),
+    concurrency: Optional[int] = Query(default=None, ge=1, le=32),
+    combined: bool = Query(default=COMBINED_EXTRACTION)
 ) -> dict:
     if not files:
         return {"error": "No files uploaded."}
     
     os.makedirs(os.path.join(UPLOAD_DIR, user_id), exist_ok=True)
 
-    user_data = {
-        "user_id": user_id,
-        "files": []
-    }
-    issues_in_documents = []
+    saved_files = []
+    request_size = 0
     try:
         for file in files:
-            file_location = os.path.join(UPLOAD_DIR, user_id, file.filename)
-            content = await file.read()
-
-            with open(file_location, "wb") as f:
-                f.write(content)
-
-            # extracted_text = await get_file_content(file_location)
-            document_classification_result = await document_classification(file_location)
-            
-            document_type = document_classification_result.get("document_type")
-            print(document_type)
-
-            if not document_type:
-                # return {"status": "partial success", "error": "Document type could not be classified."}
-                extracted_text = document_classification_result.get("extracted_text", "")
-            else:
-                extracted_text = await extract_json(
-                                    file_location, 
-                                    document_type
-                                )
-                print(extracted_text)
-                valid = validation_functions[document_type](extracted_text)
-            
-                extracted_text["document_status"] = valid["document_status"]
-                issues_in_documents = valid["issues"]
-                print(issues_in_documents)
-
+            # Unique per upload: a re-upload under the same name must not replace a file a queued job will read
+            file_location = os.path.join(UPLOAD_DIR, user_id, f"{uuid4().hex}_{os.path.basename(file.filename)}")
+            with stage_span("save_upload"):
+                file_size, file_hash = await save_upload_file(file, file_location, MAX_UPLOAD_REQUEST_SIZE - request_size)
+            request_size += file_size
 
-            file_data = {
-                "file_id": uuid4().hex,
-                "upload_date": datetime.now().strftime("%d %m %Y %H:%M:%S"),
+            saved_files.append({
                 "filename": file.filename,
                 "file_path": file_location,
-                "document_type": document_type,
-                "extracted_text": extracted_text if extracted_text else {},
-                "content_type": file.content_type
-            }
-            user_data["files"].append(file_data)
+                "content_type": file.content_type,
+                "file_hash": file_hash
+            })
+
+        with stage_span("mongodb"):
+            job = await asyncio.to_thread(create_job, user_id, saved_files, concurrency, combined)
 
-        result = insert_user_file(user_data)
-        return {"status": "success", "extracted_data": user_data, "issues_in_documents": issues_in_documents}
+    except HTTPException:
+        remove_saved_files(saved_files)
+        raise
     
     except Exception as e:
+        # No job refers to the saved files, nothing would ever process or delete them
+        remove_saved_files(saved_files)
         print(f"Error uploading files: {e}")
         return {"status": "error", "error": "Failed to upload files."}
 
+    await enqueue_job(job["job_id"])
+    return {"status": "queued", "job_id": job["job_id"]}
+
+
+def remove_saved_files(saved_files: list[dict]) -> None:
+    for saved_file in saved_files:
+        try:
+            os.remove(saved_file["file_path"])
+        except FileNotFoundError:
+            pass
+
+
+@app.get("/jobs/{job_id}")
+async def get_upload_job(job_id: str, user_id: str = Security(get_current_user)) -> dict:
+    # Polled by clients, keep the blocking MongoDB call off the event loop
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job or (job["user_id"] != user_id and not is_admin(user_id)):
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "files": [
+            {
+                "filename": file["filename"],
+                "status": file["status"],
+                "error": file["error"],
+                "file_id": file["result"]["file_id"] if file["result"] else None,
+                "document_type": file["result"]["document_type"] if file["result"] else None,
+                "issues": file["issues"],
+                "timings": file.get("timings", [])
+            }
+            for file in job["files"]
+        ],
+        "extracted_data": job["extracted_data"],
+        "issues_in_documents": job["issues_in_documents"],
+        "error": job.get("error")
+    }
+
 
 @app.post("/re_analyze_file")
 async def re_analyze_file(file_id: str, document_type: str, user_id: str = Security(get_current_user)) -> dict:
-    file_data = get_user_files(user_id, {"file_id": file_id})
+    with stage_span("mongodb", document_type):
+        file_data = get_user_files(user_id, {"file_id": file_id})
     print(file_data)
     if not file_data:
         return {"error": "File not found."}
 
     file_path = file_data[0]["file_path"]
-    extracted_text = await extract_json(file_path, document_type)
+    with stage_span("extraction", document_type):
+        extracted_text = await extract_json(file_path, document_type)
     
-    valid = validation_functions[document_type](extracted_text)
+    with stage_span("validation", document_type):
+        valid = validation_functions[document_type](extracted_text)
             
     extracted_text["document_status"] = valid["document_status"]
     issues_in_documents = valid["issues"]
@@ -232,6 +327,56 @@ async def re_analyze_file(file_id: str, document_type: str, user_id: str = Secur
     return {"status": "success", "extracted_data": user_data, "issues_in_documents": issues_in_documents}
 
 
+def stamp_crop_outputs(coordinates: list, crops: list, output: str) -> list[dict]:
+    stamps = []
+    for coordinate, cropped in zip(coordinates, crops):
+        if cropped is None:
+            continue
+        stamp = coordinate.model_dump()
+        if output == "store":
+            digest, relative_path = store_stamp_crop(cropped, STAMP_CROP_DIR)
+            stamp["sha256"] = digest
+            stamp["url"] = "/stamps/" + relative_path.replace(os.sep, "/")
+        else:
+            stamp["thumbnail"] = stamp_thumbnail(cropped)
+        stamps.append(stamp)
+    return stamps
+
+
+@app.post("/detect_stamps")
+async def detect_stamps_in_files(request: DetectStampsModel, user_id: str = Security(get_current_user)) -> dict:
+    if not request.file_ids:
+        return {"error": "No files given."}
+
+    with stage_span("mongodb"):
+        user_files = get_user_files(user_id)
+    if isinstance(user_files, dict):
+        return {"status": "error", "error": "Failed to load files."}
+    files_by_id = {file["file_id"]: file for file in user_files}
+
+    semaphore = asyncio.Semaphore(STAMP_DETECTION_CONCURRENCY)
+
+    async def detect(file_id: str) -> dict:
+        file = files_by_id.get(file_id)
+        if not file:
+            return {"file_id": file_id, "status": "error", "error": "File not found."}
+
+        async with semaphore:
+            try:
+                with stage_span("stamp_detection", file.get("document_type")):
+                    coordinates = await get_stamp_coordinates(file["file_path"], use_llm=request.use_llm)
+                    crops = await asyncio.to_thread(crop_stamps, file["file_path"], coordinates.stamp_coordinates)
+                    stamps = await asyncio.to_thread(stamp_crop_outputs, coordinates.stamp_coordinates, crops, request.output)
+            except Exception as e:
+                print(f"Error detecting stamps in {file_id}: {e}")
+                return {"file_id": file_id, "status": "error", "error": "Failed to detect stamps."}
+
+        return {"file_id": file_id, "filename": file["filename"], "status": "success", "stamps": stamps}
+
+    results = await asyncio.gather(*(detect(file_id) for file_id in dict.fromkeys(request.file_ids)))
+    return {"status": "success", "files": results}
+
+
 @app.post("/update_file_data")
 async def update_file_data(file_data: InsertUserFileModel, user_id: str = Security(get_current_user)) -> dict:
     if not file_data.user_id or not file_data.files:
@@ -253,6 +398,37 @@ async def get_all_files(user_id: str = Security(get_current_user)) -> List[dict]
         return {"status": "error"}
 
 
+@app.post("/clear_extraction_cache")
+async def clear_extraction_cache(user_id: str = Security(get_current_user)) -> dict:
+    if not is_admin(user_id):
+        return {"status": "error"}
+
+    await asyncio.to_thread(invalidate_cache)
+    return {"status": "success", "message": "Extraction cache cleared."}
+
+
+@app.post("/classification_stats")
+async def classification_stats(user_id: str = Security(get_current_user)) -> dict:
+    if not is_admin(user_id):
+        return {"status": "error"}
+
+    return {"status": "success", "classification_stats": get_classification_stats()}
+
+
+@app.post("/llm_usage_stats")
+async def llm_usage_stats(user_id: str = Security(get_current_user)) -> dict:
+    if not is_admin(user_id):
+        return {"status": "error"}
+
+    return {"status": "success", "llm_usage_stats": get_usage_stats()}
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    content, content_type = metrics_response()
+    return Response(content=content, media_type=content_type)
+
+
 @app.post("/get_files")
 async def get_files(user_id: str = Security(get_current_user), filters: FileFiltersModel | None = None) -> List[dict] | dict:
     if filters:
@@ -0,0 +1,104 @@
+from models import document_models
+from constants import LLM_TOKEN_PRICES
+
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from pydantic import BaseModel
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "document_stage_seconds", "Duration of one processing stage of a document",
+    ["stage", "document_type"], buckets=DURATION_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds", "Duration of one LLM call",
+    ["provider", "call", "document_type"], buckets=DURATION_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens", "Tokens of LLM calls, kind is input, cached_input (included in input) or output",
+    ["provider", "call", "document_type", "kind"]
+)
+LLM_COST = Counter(
+    "llm_cost_usd", "Estimated cost of LLM calls in USD, from LLM_TOKEN_PRICES",
+    ["provider", "call", "document_type"]
+)
+TRACES_DROPPED = Counter("traces_dropped", "LLM call traces dropped because the export queue was full")
+
+# Spans of the file being processed, set by collect_spans
+_current_spans: ContextVar[list | None] = ContextVar("current_spans", default=None)
+
+
+@contextmanager
+def collect_spans():
+    """
+    Collects the spans of every stage run inside the block, including stages run in
+    threads started with asyncio.to_thread, which copy the context.
+    """
+    spans = []
+    token = _current_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_spans.reset(token)
+
+
+@contextmanager
+def stage_span(stage: str, document_type: str | None = None):
+    """
+    Times a processing stage. The yielded span can be updated inside the block,
+    e.g. with the document type once classification found it.
+    """
+    span = {"stage": stage, "document_type": document_type, "seconds": None}
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span["seconds"] = round(time.perf_counter() - start, 4)
+        STAGE_SECONDS.labels(stage, span["document_type"] or "unknown").observe(span["seconds"])
+        spans = _current_spans.get()
+        if spans is not None:
+            spans.append(span)
+
+
+def llm_call_labels(schema: type[BaseModel], response: BaseModel | None) -> tuple[str, str]:
+    """
+    Returns the (call, document_type) labels of a structured LLM call. Classification
+    calls take the document type from their answer.
+    """
+    if schema.__name__ in document_models:
+        return "extraction", schema.__name__
+    if schema.__name__ == "ClassifiedDocument":
+        document = getattr(response, "document", None)
+        return "combined", getattr(document, "document_type", None) or "unknown"
+    return "classification", getattr(response, "document_type", None) or "unknown"
+
+
+def record_llm_call(provider: str, schema: type[BaseModel], response: BaseModel | None,
+                    usage_metadata: dict | None, seconds: float) -> None:
+    usage_metadata = usage_metadata or {}
+    call, document_type = llm_call_labels(schema, response)
+    input_tokens = usage_metadata.get("input_tokens", 0)
+    cached_tokens = (usage_metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+    output_tokens = usage_metadata.get("output_tokens", 0)
+
+    LLM_CALL_SECONDS.labels(provider, call, document_type).observe(seconds)
+    LLM_TOKENS.labels(provider, call, document_type, "input").inc(input_tokens)
+    LLM_TOKENS.labels(provider, call, document_type, "cached_input").inc(cached_tokens)
+    LLM_TOKENS.labels(provider, call, document_type, "output").inc(output_tokens)
+
+    prices = LLM_TOKEN_PRICES.get(provider)
+    if prices:
+        cost = ((input_tokens - cached_tokens) * prices["input"] + cached_tokens * prices["cached_input"]
+                + output_tokens * prices["output"]) / 1_000_000
+        LLM_COST.labels(provider, call, document_type).inc(cost)
+
+
+def metrics_response() -> tuple[bytes, str]:
+    """
+    :return: Tuple of the metrics in the Prometheus text format and its content type.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
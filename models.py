@@ -38,6 +38,14 @@ class FileFiltersModel(BaseModel):
     file_type: str | None
 
 
+class DetectStampsModel(BaseModel):
+    file_ids: List[str] = Field(description="Files of the user to detect stamps on")
+    output: Literal["thumbnail", "store"] = Field(
+        "thumbnail", description="thumbnail: JPEG data URLs in the response, store: PNG files served under /stamps"
+    )
+    use_llm: bool = Field(False, description="Locate stamps with the LLM instead of local detection")
+
+
 ## Initial document invocation
 ## document_type, extracted_text, stamps, signatures
 
@@ -542,3 +550,61 @@ document_models = {
     "MedicalLeave": MedicalLeave,
     "ProbationLetter": ProbationLetter
 }
+
+
+## Single call classification and extraction
+# Each wrapper carries a literal `document_type` so the union below can be discriminated on it.
+
+class PunishmentLetterDocument(BaseModel):
+    document_type: Literal["PunishmentLetter"]
+    confidence: float = Field(..., ge=0, le=1, description="Confidence score for classification")
+    fields: PunishmentLetter = Field(..., description="Fields extracted from the document")
+
+
+class EarnedLeaveLetterDocument(BaseModel):
+    document_type: Literal["EarnedLeaveLetter"]
+    confidence: float = Field(..., ge=0, le=1, description="Confidence score for classification")
+    fields: EarnedLeaveLetter = Field(..., description="Fields extracted from the document")
+
+
+class RewardLetterDocument(BaseModel):
+    document_type: Literal["RewardLetter"]
+    confidence: float = Field(..., ge=0, le=1, description="Confidence score for classification")
+    fields: RewardLetter = Field(..., description="Fields extracted from the document")
+
+
+class MedicalLeaveDocument(BaseModel):
+    document_type: Literal["MedicalLeave"]
+    confidence: float = Field(..., ge=0, le=1, description="Confidence score for classification")
+    fields: MedicalLeave = Field(..., description="Fields extracted from the document")
+
+
+class ProbationLetterDocument(BaseModel):
+    document_type: Literal["ProbationLetter"]
+    confidence: float = Field(..., ge=0, le=1, description="Confidence score for classification")
+    fields: ProbationLetter = Field(..., description="Fields extracted from the document")
+
+
+class ClassifiedDocument(BaseModel):
+    document: Union[
+        PunishmentLetterDocument,
+        EarnedLeaveLetterDocument,
+        RewardLetterDocument,
+        MedicalLeaveDocument,
+        ProbationLetterDocument
+    ] = Field(..., discriminator="document_type", description="Document type with its extracted fields")
+
+
+class StampCoordinate(BaseModel):
+    page_number: int = Field(..., description="Page number where stamp is found (1-indexed)")
+    x: int = Field(..., description="Top-left x-coordinate of stamp in pixels")
+    y: int = Field(..., description="Top-left y-coordinate of stamp in pixels")
+    width: int = Field(..., description="Width of the stamp region in pixels")
+    height: int = Field(..., description="Height of the stamp region in pixels")
+    confidence: float = Field(..., description="Confidence score of detection, between 0 and 1")
+
+
+class StampDetectionResult(BaseModel):
+    document_type: Literal["pdf", "image"]
+    filename: str
+    stamp_coordinates: List[StampCoordinate]
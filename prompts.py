@@ -51,6 +51,13 @@ Your tasks:
 """
 
 
+TEXT_EXTRACTION_PROMPT = """
+Transcribe all the text of the given document (image or PDF) page by page, keeping the reading order.
+Mark handwritten text as [handwritten: ...] and the text of stamps as [stamp: ...].
+If you find any TELUGU text, translate it into ENGLISH. Do NOT guess or add text that is not visible.
+"""
+
+
 DOCUMENT_DESCRIPTION = {
 "PunishmentLetter": "It contains R.C No followed By D.O No and date. It describes the punishment awarded and officer sign who awarded the punishment.",
 "EarnedLeaveLetter": "It contails R.C No followed by HOD No and date. It is of a format mail with Subject, Reference and Order each containing crutial information. At last it is stamped (with details like officer position, location and rank) and addressed to higher officer followed by Administrative officer sign.",
@@ -65,4 +72,97 @@ DOCUMENT_DESCRIPTION = {
 
         Counter sigining officer details will be on the stamp or near stamp in handwritten or Machine text.
     """
-}
\ No newline at end of file
+}
+
+
+# Image preprocessing per entry of DOCUMENT_DESCRIPTION, applied before pages are sent to the LLM.
+# dpi: PDF render resolution, max_edge: longest edge in pixels, grayscale: drop colour,
+# format/quality: encoding ("JPEG", "WEBP" or "PNG").
+DEFAULT_IMAGE_SETTINGS = {"dpi": 150, "max_edge": 2048, "grayscale": False, "format": "JPEG", "quality": 85}
+
+DOCUMENT_IMAGE_SETTINGS = {
+"PunishmentLetter": {"dpi": 150, "max_edge": 1600, "grayscale": False, "format": "JPEG", "quality": 80},
+"EarnedLeaveLetter": {"dpi": 150, "max_edge": 1600, "grayscale": False, "format": "JPEG", "quality": 80},
+"RewardLetter": {"dpi": 150, "max_edge": 1600, "grayscale": False, "format": "JPEG", "quality": 80},
+"MedicalLeave": {"dpi": 150, "max_edge": 1600, "grayscale": False, "format": "JPEG", "quality": 80},
+# Three dense pages of mostly printed text, stamps are identified by their wording
+"ProbationLetter": {"dpi": 150, "max_edge": 2048, "grayscale": True, "format": "JPEG", "quality": 80}
+}
+
+# Regions of interest sent to extraction instead of the full pages (ROI_EXTRACTION).
+# page: 1-indexed, box: (left, top, right, bottom) as fractions of the page,
+# fields: schema fields expected in the region, None for every field of the schema.
+# Few large regions: images are billed per 512px tile, several small crops can cost more than the page.
+DOCUMENT_LAYOUT_PROFILES = {
+# Single page letters end well above the bottom margin
+"PunishmentLetter": [{"page": 1, "box": (0.0, 0.0, 1.0, 0.8), "fields": None}],
+"EarnedLeaveLetter": [{"page": 1, "box": (0.0, 0.0, 1.0, 0.8), "fields": None}],
+"RewardLetter": [{"page": 1, "box": (0.0, 0.0, 1.0, 0.8), "fields": None}],
+"MedicalLeave": [{"page": 1, "box": (0.0, 0.0, 1.0, 0.8), "fields": None}],
+# Register of probationer on page 1, Form-A items 1-4 on page 2, officers' remarks on page 3
+"ProbationLetter": [
+    {"page": 1, "box": (0.0, 0.0, 1.0, 1.0), "fields": [
+        "service_class_category", "name_of_probationer", "date_of_regularization", "period_of_probation_prescribed",
+        "leave_taken_during_probation", "date_of_completion_of_probation", "tests_to_passed_during_probation",
+        "punishment_during_probation", "pending_pr_oe", "character_and_conduct", "firing_practice_completed",
+        "remarks_of_ic_officer", "remarks_of_commandant", "remarks_of_dig", "adgp_orders", "stamp1", "signature1"
+    ]},
+    {"page": 2, "box": (0.0, 0.0, 1.0, 0.62), "fields": [
+        "dob", "salary", "qualification", "acceptance_of_self_appraisal_report_part1",
+        "assessment_of_officers_permormance_during_the_year"
+    ]},
+    {"page": 3, "box": (0.0, 0.2, 1.0, 0.95), "fields": [
+        "reporting_officer", "counter_singing_officer", "head_of_department_opinion",
+        "stamp2", "signature2", "stamp3", "signature3", "stamp4", "signature4", "stamp5", "signature5"
+    ]}
+]
+}
+
+# Stamp fields filled from the offline stamp index when LOCAL_STAMP_MATCHING is on.
+# field -> (page, name of the stamp expected there), a None page or name matches any.
+STAMP_FIELDS = {
+"EarnedLeaveLetter": {"stamp": (1, None)},
+"RewardLetter": {"stamp": (1, None)},
+"MedicalLeave": {"stamp": (1, None)},
+# DIG stamp with the register on page 1, the officers' stamps with their remarks on page 3
+"ProbationLetter": {
+    "stamp1": (1, "Dy. Inspector General of Police, Mangalagiri"),
+    "stamp2": (3, "Addl. Director General of Police"),
+    "stamp3": (3, "Head Officer, Mangalagiri"),
+    "stamp4": (3, "Dy. Inspector General of Police, Mangalagiri"),
+    "stamp5": (3, "Addl. Director General of Police")
+}
+}
+
+local_stamp_matching_note = "No stamp reference is given, stamps are identified separately: return None for the stamp fields."
+
+classify_and_extract_prompt = """
+You are a document classification and extraction expert for official documents from police departments and other administrative sources.
+You are also given a separate reference image that contains known stamp names.
+
+Your tasks:
+
+1. **Classify the document** into one of the following types, using the descriptions below:
+   - PunishmentLetter
+   - EarnedLeaveLetter
+   - RewardLetter
+   - MedicalLeave
+   - ProbationLetter
+   Return the type as `document_type` and a confidence score (0.0 to 1.0) as `confidence`.
+
+2. **Extract fields** using the schema of the chosen document type only:
+    - For each field in the schema, provide the extracted text from document (or `None` if not found), a confidence score (0.0 to 1.0), and whether the text is `machine_printed` or `handwritten`.
+
+3. **Detect stamps**:
+    - If you find any stamp in the document image that matches a stamp from the reference image, copy its **name** into the respective `stampX` field (e.g., `stamp1`, `stamp2`, etc.).
+    - If a stamp is **not** present, return `None`.
+
+4. **Translate**:
+    - If you find any TELUGU text in the data transilate into ENGLISH
+
+**Important rules**:
+- Do NOT guess or hallucinate missing text.
+- Use only what's visible in the document image.
+- If you're unsure about classification, still pick the closest type and lower the confidence.
+- Populate every field from the schema, even if text are missing (use `None` then).
+"""
@@ -0,0 +1,8 @@
+import tempfile
+import os
+
+# Offline settings, read by constants.py when the application modules are first imported
+os.environ.setdefault("LLM_PROVIDERS", "fake")
+os.environ.setdefault("EXTRACTION_CACHE_PERSISTENT", "false")
+os.environ.setdefault("TRACE_SAMPLE_RATE", "0")
+os.environ.setdefault("RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "document_analyzer_test_renders"))
@@ -0,0 +1,59 @@
+from MongoDB import database
+
+
+class FakeCollection:
+    def __init__(self, indexes: dict):
+        self.indexes = indexes
+        self.created = []
+        self.dropped = []
+
+    def create_index(self, key: str, **options):
+        self.created.append((key, options))
+
+    def index_information(self) -> dict:
+        return self.indexes
+
+    def drop_index(self, name: str):
+        self.dropped.append(name)
+
+
+class FakeClient:
+    def __init__(self, collection: FakeCollection):
+        self.collection = collection
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __getitem__(self, name: str):
+        # client[DATABASE_NAME] is the client itself, db[EXTRACTION_CACHE_COLLECTION_NAME] the collection
+        return self.collection if name == database.EXTRACTION_CACHE_COLLECTION_NAME else self
+
+    def command(self, *args, **kwargs):
+        self.commands.append((args, kwargs))
+
+
+def create_indexes(monkeypatch, ttl_seconds: int, indexes: dict) -> FakeClient:
+    client = FakeClient(FakeCollection(indexes))
+    monkeypatch.setattr(database, "MongoClient", lambda uri: client)
+    assert database.create_extraction_cache_indexes(ttl_seconds) == {"status": "success"}
+    return client
+
+
+def test_cache_key_index_is_unique(monkeypatch):
+    client = create_indexes(monkeypatch, 0, {})
+    assert client.collection.created == [("cache_key", {"unique": True})]
+
+
+def test_ttl_index_is_created_updated_and_dropped(monkeypatch):
+    client = create_indexes(monkeypatch, 3600, {})
+    assert ("created_at", {"expireAfterSeconds": 3600}) in client.collection.created
+
+    client = create_indexes(monkeypatch, 7200, {"created_at_1": {"expireAfterSeconds": 3600}})
+    assert client.commands[0][1]["index"] == {"keyPattern": {"created_at": 1}, "expireAfterSeconds": 7200}
+
+    client = create_indexes(monkeypatch, 0, {"created_at_1": {"expireAfterSeconds": 3600}})
+    assert client.collection.dropped == ["created_at_1"]
@@ -0,0 +1,180 @@
+from Text_extraction import extract_data
+from Text_extraction.extract_data import fill_stamp_fields, empty_region_fields, is_empty_value, region_fields, optimise_image
+from Text_extraction.providers import llm_router, FakeProvider
+from models import RewardLetter, ProbationLetter
+
+from PIL import Image
+import asyncio
+import io
+
+
+DIG = "Dy. Inspector General of Police, Mangalagiri"
+ADGP = "Addl. Director General of Police"
+HEAD_OFFICER = "Head Officer, Mangalagiri"
+
+
+def stamp(page_number: int, name: str, confidence: float) -> dict:
+    return {"page_number": page_number, "name": name, "confidence": confidence}
+
+
+def test_stamp_fills_only_the_field_of_its_page():
+    # Probation sample_3: the DIG stamp is on page 1 only
+    fields = fill_stamp_fields("ProbationLetter", {}, [
+        stamp(1, HEAD_OFFICER, 0.61), stamp(1, DIG, 0.38), stamp(3, HEAD_OFFICER, 0.48)
+    ])
+
+    assert fields["stamp1"]["extracted_text"] == DIG
+    assert fields["stamp3"]["extracted_text"] == HEAD_OFFICER
+    assert "stamp4" not in fields
+
+
+def test_each_stamp_fills_at_most_one_field():
+    fields = fill_stamp_fields("ProbationLetter", {}, [stamp(3, ADGP, 0.5)])
+    assert list(fields) == ["stamp2"]
+
+    fields = fill_stamp_fields("ProbationLetter", {}, [stamp(3, ADGP, 0.5), stamp(3, ADGP, 0.9)])
+    assert (fields["stamp2"]["confidence"], fields["stamp5"]["confidence"]) == (0.9, 0.5)
+
+
+def test_letter_takes_most_confident_stamp():
+    fields = fill_stamp_fields("RewardLetter", {"stamp": {"extracted_text": None}}, [
+        stamp(1, HEAD_OFFICER, 0.4), stamp(1, DIG, 0.7)
+    ])
+    assert fields["stamp"] == {"extracted_text": DIG, "confidence": 0.7, "text_type": "machine_printed"}
+
+
+def test_unknown_document_type_is_left_unchanged():
+    assert fill_stamp_fields("PunishmentLetter", {"rc_no": {}}, [stamp(1, DIG, 0.9)]) == {"rc_no": {}}
+
+
+def cache_keys(monkeypatch, call) -> list[str]:
+    keys = []
+    monkeypatch.setattr(extract_data, "get_cached_result", lambda key: keys.append(key) or {"cached": True})
+    asyncio.run(call())
+    return keys
+
+
+def test_cache_keys_change_with_content_settings(monkeypatch):
+    def classify():
+        return extract_data.document_classification("letter.jpg", file_hash="hash")
+
+    def extract():
+        return extract_data.extract_json("letter.jpg", "RewardLetter", file_hash="hash")
+
+    classification_key, extraction_key = cache_keys(monkeypatch, classify) + cache_keys(monkeypatch, extract)
+    assert cache_keys(monkeypatch, classify) == [classification_key]
+
+    monkeypatch.setattr(extract_data, "TEXT_LAYER_FAST_PATH", not extract_data.TEXT_LAYER_FAST_PATH)
+    assert cache_keys(monkeypatch, classify) != [classification_key]
+    assert cache_keys(monkeypatch, extract) != [extraction_key]
+    monkeypatch.undo()
+
+    monkeypatch.setattr(extract_data, "CLASSIFICATION_MIN_CONFIDENCE", 0.5)
+    monkeypatch.setattr(extract_data, "CLASSIFICATION_PASSES", [(1, 72, 512)])
+    assert cache_keys(monkeypatch, classify) != [classification_key]
+    monkeypatch.undo()
+
+    monkeypatch.setitem(extract_data.DOCUMENT_IMAGE_SETTINGS, "RewardLetter", {"grayscale": True, "quality": 40})
+    assert cache_keys(monkeypatch, extract) != [extraction_key]
+
+
+def png_image(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_image_without_changes_is_returned_untouched():
+    image_bytes = png_image(400, 300)
+
+    assert optimise_image(image_bytes, "PNG") == (image_bytes, "image/png")
+    assert optimise_image(image_bytes, "PNG", 400, {"format": "PNG", "max_edge": 500}) == (image_bytes, "image/png")
+
+
+def test_image_is_downscaled_to_the_smallest_max_edge():
+    image_bytes, mimetype = optimise_image(png_image(1000, 500), "PNG", 800, {"max_edge": 400})
+
+    image = Image.open(io.BytesIO(image_bytes))
+    assert (image.format, image.size, mimetype) == ("PNG", (400, 200), "image/png")
+
+
+def test_image_is_converted_to_grayscale_jpeg():
+    image_bytes, mimetype = optimise_image(png_image(400, 300), "PNG", None, {"grayscale": True, "format": "JPEG"})
+
+    image = Image.open(io.BytesIO(image_bytes))
+    assert (image.format, image.mode, image.size, mimetype) == ("JPEG", "L", (400, 300), "image/jpeg")
+
+
+def test_lower_quality_gives_a_smaller_jpeg():
+    source = io.BytesIO()
+    Image.effect_noise((400, 300), 60).convert("RGB").save(source, format="JPEG", quality=95)
+
+    high, _ = optimise_image(source.getvalue(), "JPEG", None, {"quality": 90})
+    low, mimetype = optimise_image(source.getvalue(), "JPEG", None, {"quality": 30})
+    assert len(low) < len(high) < len(source.getvalue())
+    assert mimetype == "image/jpeg"
+
+
+def test_empty_values():
+    assert is_empty_value(None) and is_empty_value("") and is_empty_value([])
+    assert is_empty_value({"extracted_text": None, "confidence": 0.9})
+    assert is_empty_value([{"extracted_text": ""}, {"name": {"extracted_text": None}}])
+    assert not is_empty_value({"extracted_text": "C1/51/2023"})
+    assert not is_empty_value(False)
+
+
+def test_empty_region_fields_lists_only_regions_without_any_value():
+    profile = [
+        {"page": 1, "box": (0, 0, 1, 1), "fields": ["stamp1", "signature1"]},
+        {"page": 3, "box": (0, 0, 1, 1), "fields": ["stamp3", "signature3"]}
+    ]
+    result = {
+        "stamp1": {"extracted_text": None}, "signature1": {"extracted_text": "signed"},
+        "stamp3": {"extracted_text": None}, "signature3": {"extracted_text": ""}
+    }
+    assert empty_region_fields(ProbationLetter, profile, result) == ["stamp3", "signature3"]
+
+
+def reward_letter_response(messages: list) -> dict | None:
+    # Fields come back empty from the regions and filled from the full pages
+    if any(block.get("text", "").startswith("Region of page") for block in messages[1]["content"]):
+        return None
+    fields = {
+        RewardLetter.model_fields[name].alias or name: {"extracted_text": "read from the page"}
+        for name in region_fields(RewardLetter, {"fields": None})
+        if name not in ("reference_orders", "reward_details")
+    }
+    return {**fields, "document_status": "Valid"}
+
+
+def extract_reward_letter(tmp_path, monkeypatch, response) -> tuple[dict, FakeProvider]:
+    letter_path = str(tmp_path / "letter.jpg")
+    Image.new("RGB", (1000, 1400), "white").save(letter_path)
+
+    async def load_stamp_reference(stamp_reference_path: str) -> list:
+        return []
+
+    provider = FakeProvider(responses={RewardLetter: response})
+    monkeypatch.setattr(llm_router, "providers", [provider])
+    monkeypatch.setattr(extract_data, "ROI_EXTRACTION", True)
+    monkeypatch.setattr(extract_data, "LOCAL_STAMP_MATCHING", False)
+    monkeypatch.setattr(extract_data, "load_stamp_reference", load_stamp_reference)
+    monkeypatch.setattr(extract_data, "get_cached_result", lambda key: None)
+    monkeypatch.setattr(extract_data, "set_cached_result", lambda key, result: None)
+    return asyncio.run(extract_data.extract_json(letter_path, "RewardLetter", file_hash="hash")), provider
+
+
+def test_empty_regions_are_read_again_from_full_pages(tmp_path, monkeypatch):
+    result, provider = extract_reward_letter(tmp_path, monkeypatch, reward_letter_response)
+
+    assert provider.calls == 2
+    assert result["rc_no"]["extracted_text"] == "read from the page"
+
+
+def test_regions_with_values_are_not_read_again(tmp_path, monkeypatch):
+    result, provider = extract_reward_letter(tmp_path, monkeypatch, {
+        "R c No.": {"extracted_text": "C1/51/2023"}, "document_status": "Valid"
+    })
+
+    assert provider.calls == 1
+    assert result["rc_no"]["extracted_text"] == "C1/51/2023"
@@ -0,0 +1,38 @@
+from Image_extraction.get_image_coord import crop_pdf_stamps
+from Text_extraction.render_cache import render_pages
+from models import StampCoordinate
+
+import fitz
+
+
+PAGE_COLOURS = [((1, 0, 0), (0, 0, 1)), ((0, 1, 0), (1, 1, 0)), ((0, 1, 1), (1, 0, 1))]  # left, right half of each page
+
+
+def three_page_pdf(path: str) -> str:
+    with fitz.open() as doc:
+        for left, right in PAGE_COLOURS:
+            page = doc.new_page(width=200, height=200)
+            page.draw_rect(fitz.Rect(0, 0, 100, 200), color=left, fill=left)
+            page.draw_rect(fitz.Rect(100, 0, 200, 200), color=right, fill=right)
+        doc.save(path)
+    return path
+
+
+def coord(page_number: int, right_half: bool) -> StampCoordinate:
+    # Pixels of the page rendered at 150 dpi: 200pt is about 416px
+    return StampCoordinate(page_number=page_number, x=260 if right_half else 40, y=100, width=50, height=50, confidence=0.9)
+
+
+def crop_colours(pdf_path: str, coords: list[StampCoordinate]) -> list:
+    return [crop.getpixel((25, 25)) if crop else None for crop in crop_pdf_stamps(pdf_path, coords)]
+
+
+def test_crops_follow_the_order_of_the_coordinates(tmp_path):
+    pdf_path = three_page_pdf(str(tmp_path / "stamps.pdf"))
+    coords = [coord(3, True), coord(1, False), coord(2, True), coord(1, True), coord(5, False), coord(3, False)]
+    expected = [(255, 0, 255), (255, 0, 0), (255, 255, 0), (0, 0, 255), None, (0, 255, 255)]
+
+    # Rasterized pages, then the same pages decoded from the render cache
+    assert crop_colours(pdf_path, coords) == expected
+    render_pages(pdf_path, [0, 1, 2])
+    assert crop_colours(pdf_path, coords) == expected
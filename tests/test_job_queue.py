@@ -0,0 +1,64 @@
+from Jobs import job_queue
+from Text_extraction.providers import llm_router, FakeProvider
+from models import DocumentClassificationResult, PunishmentLetter
+
+from PIL import Image
+import asyncio
+import time
+
+
+LLM_LATENCY = 0.2
+
+
+def test_files_of_a_job_are_processed_concurrently(tmp_path, monkeypatch):
+    files = []
+    for index in range(4):
+        path = tmp_path / f"letter_{index}.jpg"
+        Image.new("RGB", (200, 280), "white").save(path)
+        files.append({"filename": path.name, "file_path": str(path), "content_type": "image/jpeg", "file_hash": f"hash{index}",
+                      "status": "queued", "error": None, "result": None, "issues": [], "timings": []})
+    job = {"job_id": "job", "user_id": "user", "concurrency": 4, "combined": False, "files": files}
+
+    provider = FakeProvider(latency=LLM_LATENCY, responses={
+        DocumentClassificationResult: {"document_type": "PunishmentLetter", "confidence": 0.99, "extracted_text": []},
+        PunishmentLetter: {
+            "R c. No": {"extracted_text": "C1/51/PR-12/22-23"},
+            "D. O No": {"extracted_text": "417/2023"},
+            "Order_date": {"extracted_text": "12-03-2023"},
+            "Punishment_awarded": {"extracted_text": "PP II"},
+            "Deliquency_Description": {"extracted_text": "Absent from duty w.e.f. 01-02-2023"},
+            "Issued By": {"extracted_text": "Superintendent of Police, Kurnool"},
+            "Issued Date": {"extracted_text": "12-03-2023"},
+            "Signature": {"extracted_text": "signed"},
+            "document_status": "Valid"
+        }
+    })
+    monkeypatch.setattr(llm_router, "providers", [provider])
+
+    stored = {}
+    monkeypatch.setattr(job_queue, "get_job", lambda job_id: job)
+    monkeypatch.setattr(job_queue, "update_job", lambda job_id, update: {"status": "success"})
+    monkeypatch.setattr(job_queue, "insert_user_file", lambda user_data: stored.update(user_data) or {"status": "success"})
+
+    # Earlier files wait longer, so they finish last
+    durations = {}
+    process_file = job_queue.process_file
+
+    async def timed_process_file(file_entry: dict, combined: bool = False):
+        start = time.perf_counter()
+        await asyncio.sleep(0.05 * (len(files) - files.index(file_entry)))
+        result = await process_file(file_entry, combined)
+        durations[file_entry["filename"]] = time.perf_counter() - start
+        return result
+
+    monkeypatch.setattr(job_queue, "process_file", timed_process_file)
+
+    start = time.perf_counter()
+    asyncio.run(job_queue.process_job("job"))
+    wall_time = time.perf_counter() - start
+
+    assert provider.calls == 2 * len(files)
+    assert len(durations) == len(files)
+    assert wall_time < sum(durations.values())
+    assert [file["filename"] for file in stored["files"]] == [file["filename"] for file in files]
+    assert all(file["document_type"] == "PunishmentLetter" for file in stored["files"])
@@ -0,0 +1,50 @@
+import main
+
+from fastapi.testclient import TestClient
+import pytest
+import os
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    main.app.dependency_overrides[main.get_current_user] = lambda: "user"
+    yield TestClient(main.app)
+    main.app.dependency_overrides.clear()
+
+
+def upload(client: TestClient) -> dict:
+    return client.post("/upload_files", files=[
+        ("files", ("letter.pdf", b"%PDF-1.4 letter", "application/pdf")),
+        ("files", ("letter.pdf", b"%PDF-1.4 other letter", "application/pdf"))
+    ]).json()
+
+
+def test_uploads_are_queued_under_unique_paths(client, tmp_path, monkeypatch):
+    jobs, queued = [], []
+
+    async def enqueue_job(job_id: str):
+        queued.append(job_id)
+
+    monkeypatch.setattr(main, "create_job", lambda user_id, files, concurrency, combined: jobs.append(files) or {"job_id": "job"})
+    monkeypatch.setattr(main, "enqueue_job", enqueue_job)
+
+    assert upload(client) == {"status": "queued", "job_id": "job"}
+    assert queued == ["job"]
+    assert len({file["file_path"] for file in jobs[0]}) == 2
+    assert all(os.path.exists(file["file_path"]) for file in jobs[0])
+
+
+def test_saved_files_are_removed_when_the_job_is_not_created(client, tmp_path, monkeypatch):
+    def create_job(user_id, files, concurrency, combined):
+        raise RuntimeError("MongoDB is down")
+
+    monkeypatch.setattr(main, "create_job", create_job)
+
+    assert upload(client)["status"] == "error"
+    assert os.listdir(tmp_path / "user") == []
+
+
+def test_unknown_job_is_not_found(client, monkeypatch):
+    monkeypatch.setattr(main, "get_job", lambda job_id: None)
+    assert client.get("/jobs/missing").status_code == 404
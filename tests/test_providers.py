@@ -0,0 +1,96 @@
+from Text_extraction import providers
+from Text_extraction.providers import ProviderRouter, FakeProvider
+from Text_extraction.rate_limit import ProviderLimiter
+
+from pydantic import BaseModel
+import asyncio
+import pytest
+import time
+
+
+class Answer(BaseModel):
+    provider: str
+
+
+def fake_provider(name: str, **kwargs) -> FakeProvider:
+    return FakeProvider(name, responses={Answer: {"provider": name}}, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def first_provider_is_primary(monkeypatch):
+    monkeypatch.setattr(providers.random, "choices", lambda population, weights: [population[0]])
+
+
+def test_failover_to_next_provider():
+    primary = fake_provider("primary", error=RuntimeError("unavailable"))
+    backup = fake_provider("backup")
+    router = ProviderRouter([primary, backup], hedging=False)
+
+    answer = asyncio.run(router.ainvoke_structured(Answer, []))
+
+    assert answer.provider == "backup"
+    assert (primary.calls, backup.calls) == (1, 1)
+
+
+def test_failover_on_timeout():
+    primary = fake_provider("primary", latency=1.0)
+    backup = fake_provider("backup")
+    router = ProviderRouter([primary, backup], timeout=0.05, hedging=False)
+
+    assert asyncio.run(router.ainvoke_structured(Answer, [])).provider == "backup"
+
+
+def test_last_error_is_raised_when_every_provider_fails():
+    router = ProviderRouter([fake_provider("primary", error=RuntimeError("first")),
+                             fake_provider("backup", error=ValueError("second"))], hedging=False)
+
+    with pytest.raises(ValueError, match="second"):
+        asyncio.run(router.ainvoke_structured(Answer, []))
+
+
+def test_hedged_request_answered_by_backup():
+    primary = fake_provider("primary", latency=1.0)
+    backup = fake_provider("backup", latency=0.01)
+    router = ProviderRouter([primary, backup], hedging=True, hedge_delay=0.05)
+
+    start = time.perf_counter()
+    answer = asyncio.run(router.ainvoke_structured(Answer, []))
+
+    assert answer.provider == "backup"
+    assert time.perf_counter() - start < 0.5
+    assert (primary.calls, backup.calls) == (1, 1)
+
+
+def test_fast_primary_is_not_hedged():
+    primary = fake_provider("primary")
+    backup = fake_provider("backup")
+    router = ProviderRouter([primary, backup], hedging=True, hedge_delay=0.2)
+
+    assert asyncio.run(router.ainvoke_structured(Answer, [])).provider == "primary"
+    assert backup.calls == 0
+
+
+def test_failed_primary_is_hedged_immediately():
+    primary = fake_provider("primary", error=RuntimeError("unavailable"))
+    backup = fake_provider("backup")
+    router = ProviderRouter([primary, backup], hedging=True, hedge_delay=1.0)
+
+    start = time.perf_counter()
+    assert asyncio.run(router.ainvoke_structured(Answer, [])).provider == "backup"
+    assert time.perf_counter() - start < 0.5
+
+
+def test_hedge_budget_starts_after_admission():
+    primary = fake_provider("primary", latency=0.01)
+    primary.limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, max_concurrency=1)
+    backup = fake_provider("backup")
+    router = ProviderRouter([primary, backup], hedging=True, hedge_delay=0.1)
+
+    async def run():
+        # The primary queues behind another call for longer than the hedge delay
+        await primary.limiter.concurrency.acquire()
+        asyncio.get_running_loop().call_later(0.3, asyncio.ensure_future, primary.limiter.concurrency.release(True))
+        return await router.ainvoke_structured(Answer, [])
+
+    assert asyncio.run(run()).provider == "primary"
+    assert backup.calls == 0
@@ -0,0 +1,121 @@
+from Text_extraction import rate_limit
+from Text_extraction.rate_limit import AdaptiveConcurrencyLimiter, ProviderLimiter, is_throttle_error, is_transient_error
+
+import asyncio
+import pytest
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class StatusError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def run_calls(limiter: ProviderLimiter, call, count: int = 1) -> None:
+    async def run():
+        for _ in range(count):
+            try:
+                await limiter.run(call)
+            except Exception:
+                pass
+
+    asyncio.run(run())
+
+
+def test_throttle_errors_are_recognised_by_type_and_status():
+    assert is_throttle_error(RateLimitError("slow down"))
+    assert is_throttle_error(StatusError(429))
+    assert not is_throttle_error(StatusError(500))
+    assert not is_throttle_error(ValueError("invoice 4291 has no rate limit field"))
+
+
+def test_transient_errors_are_recognised_by_type_and_status():
+    assert is_transient_error(StatusError(503))
+    assert is_transient_error(ConnectionResetError("reset by peer"))
+    assert is_transient_error(TimeoutError())
+    assert not is_transient_error(StatusError(400))
+    assert not is_transient_error(StatusError(429))
+    assert not is_transient_error(ValueError("bad response"))
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(rate_limit, "LLM_BACKOFF_BASE_SECONDS", 0)
+    limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, max_concurrency=8,
+                              max_retries=5, max_transient_retries=2)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise StatusError(503)
+        return "ok"
+
+    assert asyncio.run(limiter.run(flaky)) == "ok"
+    assert len(calls) == 3
+
+    calls.clear()
+
+    async def down():
+        calls.append(1)
+        raise StatusError(502)
+
+    with pytest.raises(StatusError):
+        asyncio.run(limiter.run(down))
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried():
+    limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, max_concurrency=8)
+    calls = []
+
+    async def invalid():
+        calls.append(1)
+        raise ValueError("bad response")
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run(invalid))
+    assert len(calls) == 1
+
+
+def test_concurrency_grows_only_on_success():
+    limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, max_concurrency=8, max_retries=0)
+    initial = limiter.concurrency.limit
+
+    async def fail():
+        raise ValueError("bad response")
+
+    run_calls(limiter, fail, 5)
+    assert limiter.concurrency.limit == initial
+
+    async def succeed():
+        return "ok"
+
+    run_calls(limiter, succeed, 5)
+    assert limiter.concurrency.limit > initial
+
+
+def test_concurrency_halves_when_throttled():
+    limiter = ProviderLimiter(requests_per_minute=6000, tokens_per_minute=10 ** 6, max_concurrency=8, max_retries=0)
+
+    async def throttled():
+        raise RateLimitError("429")
+
+    run_calls(limiter, throttled)
+    assert limiter.concurrency.limit == 2
+
+
+def test_waiters_are_admitted_in_turn():
+    async def run():
+        limiter = AdaptiveConcurrencyLimiter(initial=1, maximum=1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await limiter.release(succeeded=True)
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
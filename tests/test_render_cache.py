@@ -0,0 +1,21 @@
+from Text_extraction import render_cache
+
+import fitz
+import os
+
+
+def test_broken_render_pool_is_replaced(tmp_path):
+    pdf_path = str(tmp_path / "two_pages.pdf")
+    with fitz.open() as doc:
+        for text in ("first", "second"):
+            doc.new_page().insert_text((72, 72), text)
+        doc.save(pdf_path)
+
+    # A worker dying, as when killed for running out of memory, breaks the whole pool
+    broken_pool = render_cache.get_render_pool()
+    broken_pool.submit(os._exit, 1).exception()
+
+    images = render_cache.render_pages(pdf_path, [0, 1], dpi=30)
+
+    assert all(image.startswith(b"\x89PNG") for image in images)
+    assert render_cache.get_render_pool() is not broken_pool
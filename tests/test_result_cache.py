@@ -0,0 +1,49 @@
+from Text_extraction import result_cache
+from Text_extraction.result_cache import extraction_cache_key, get_cached_result, set_cached_result, prompt_version
+from models import RewardLetter, PunishmentLetter
+
+import pytest
+
+
+@pytest.fixture
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(result_cache, "EXTRACTION_CACHE_SIZE", 2)
+    monkeypatch.setattr(result_cache, "EXTRACTION_CACHE_PERSISTENT", False)
+    monkeypatch.setattr(result_cache, "_memory_cache", result_cache.OrderedDict())
+    return result_cache._memory_cache
+
+
+def test_least_recently_used_result_is_evicted(memory_cache):
+    set_cached_result("a", {"value": 1})
+    set_cached_result("b", {"value": 2})
+    assert get_cached_result("a") == {"value": 1}
+
+    set_cached_result("c", {"value": 3})
+    assert list(memory_cache) == ["a", "c"]
+    assert get_cached_result("b") is None
+
+
+def test_cached_results_are_copies(memory_cache):
+    result = {"fields": {"name": "A"}}
+    set_cached_result("a", result)
+    result["fields"]["name"] = "B"
+
+    cached = get_cached_result("a")
+    cached["fields"]["name"] = "C"
+    assert get_cached_result("a") == {"fields": {"name": "A"}}
+
+
+def test_every_part_of_the_key_changes_it():
+    base = ("extract", "hash", "RewardLetter", "gemini", ["prompt"], RewardLetter)
+    key = extraction_cache_key(*base)
+    assert extraction_cache_key(*base) == key
+
+    for index, value in enumerate(("classify", "other", None, "gpt", ["prompt", "settings"], PunishmentLetter)):
+        changed = list(base)
+        changed[index] = value
+        assert extraction_cache_key(*changed) != key
+
+
+def test_prompt_version_separates_prompts():
+    assert prompt_version("ab", "c") != prompt_version("a", "bc")
+    assert prompt_version("a") == prompt_version("a")
@@ -0,0 +1,20 @@
+from Text_extraction.tracing import TraceExporter
+
+import base64
+
+
+def test_images_are_hashed_before_queueing():
+    image_url = "data:image/png;base64," + base64.b64encode(b"\x89PNG" * 100_000).decode()
+    message = {"role": "user", "content": [{"type": "text", "text": "Extract"},
+                                           {"type": "image_url", "image_url": {"url": image_url}}]}
+    exporter = TraceExporter(lambda batch: None, max_queue=1)
+    exporter._ensure_thread = lambda: None  # keep the record on the queue
+
+    exporter.submit({"input": [message], "output": None})
+    exporter.submit({"input": [message], "output": None})
+
+    queued = exporter.queue.get_nowait()
+    image_block = queued["input"][0]["content"][1]
+    assert image_block["image_url"]["url"].startswith("sha256:")
+    assert image_block["image_url"]["size"] == len(image_url)
+    assert exporter.dropped == 1